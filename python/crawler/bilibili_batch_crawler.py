@@ -0,0 +1,137 @@
+import heapq
+import itertools
+import json
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import bilibili_video_crawler
+from bilibili_video_crawler import CRAWL_MODES, bilibili_crawl, empty_result, short_link_resolver
+
+
+class BilibiliBatchCrawler:
+    """
+    批量抓取哔哩哔哩链接
+    链接按流的方式读取，最多同时处理workers个；页面请求、资源下载、音视频合并分别限制并发；
+    bilibili_crawl返回reverse=1（或抛异常）的链接按指数退避重新排队，结果完成一个输出一个
+    mode同bilibili_crawl的抓取模式，只刷新元数据时用metadata；page_ttl秒内抓过的页面直接用缓存，
+    offline为True时只用缓存的页面，不发任何请求（只能用metadata模式）；
+    fallback_reencode为True时直接复制音视频流失败会改为重新编码；video_policy/audio_policy是这批任务的音视频流选择策略
+    链接每resolve_batch个一批先并发解析短链，指向同一个视频或动态的链接只抓取第一个，
+    后面重复的链接不抓取，输出一条带duplicate_of（第一个链接）和canonical_url（标准链接）的结果
+    """
+
+    def __init__(self, cookies, workers=8, page_limit=4, download_limit=8, mux_limit=2, max_requeue=3,
+                 backoff=30, resolve_batch=200, mode='full', page_ttl=0, offline=False, fallback_reencode=False,
+                 video_policy=None, audio_policy=None):
+        if mode not in CRAWL_MODES:
+            raise ValueError(f'不支持的抓取模式：{mode}')
+        if offline and mode != 'metadata':
+            raise ValueError('离线模式不能下载资源，只能使用metadata模式')
+        self.cookies = cookies
+        self.workers = workers
+        self.max_requeue = max_requeue
+        self.backoff = backoff
+        self.resolve_batch = resolve_batch
+        self.mode = mode
+        self.offline = offline
+        self.fallback_reencode = fallback_reencode
+        self.video_policy = video_policy
+        self.audio_policy = audio_policy
+        bilibili_video_crawler.set_concurrency_limits(page_limit, download_limit, mux_limit)
+        bilibili_video_crawler.set_page_cache_ttl(page_ttl)
+
+    @staticmethod
+    def duplicate_result(link, first_link, canonical):
+        """
+        重复链接的结果：不抓取，标出它和哪个链接重复
+        """
+        return dict(empty_result(link), duplicate_of=first_link, canonical_url=canonical)
+
+    def unique_links(self, links):
+        """
+        按批解析短链，逐个返回(链接, 重复链接的结果)；第一次出现的链接结果为None，
+        和前面的链接指向同一个标准链接的重复链接直接给出结果，不需要抓取
+        """
+        seen = {}
+        links = iter(links)
+        while True:
+            batch = list(itertools.islice(links, self.resolve_batch))
+            if not batch:
+                return
+            resolved = short_link_resolver().resolve_many(batch, self.offline)
+            for link in batch:
+                canonical = resolved[link.strip()]
+                if canonical in seen:
+                    print(f'{link}和之前的链接重复（{canonical}），跳过')
+                    yield link, self.duplicate_result(link, seen[canonical], canonical)
+                    continue
+                seen[canonical] = link
+                yield link, None
+
+    def crawl_one(self, link):
+        try:
+            return bilibili_crawl(link, self.cookies, mode=self.mode, offline=self.offline,
+                                  fallback_reencode=self.fallback_reencode, video_policy=self.video_policy,
+                                  audio_policy=self.audio_policy)
+        except Exception as e:
+            print(f'{link}抓取失败', e)
+            return dict(empty_result(link), reverse=1)
+
+    def run(self, links):
+        """
+        逐个返回抓取结果（完成顺序，不是输入顺序）
+        """
+        links = self.unique_links(links)
+        exhausted = False
+        # 等待重新排队的链接：(可以开始的时间, 序号, 链接, 已重试次数)
+        delayed = []
+        counter = itertools.count()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                now = time.monotonic()
+                while len(running) < self.workers:
+                    if delayed and delayed[0][0] <= now:
+                        _, _, link, attempt = heapq.heappop(delayed)
+                    elif not exhausted:
+                        link, duplicate = next(links, (None, None))
+                        if link is None:
+                            exhausted = True
+                            continue
+                        if duplicate:
+                            yield duplicate
+                            continue
+                        attempt = 0
+                    else:
+                        break
+                    running[executor.submit(self.crawl_one, link)] = (link, attempt)
+                if not running:
+                    if not delayed:
+                        return
+                    time.sleep(max(delayed[0][0] - now, 0))
+                    continue
+                timeout = max(delayed[0][0] - now, 0) if delayed else None
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    link, attempt = running.pop(future)
+                    result = future.result()
+                    if result and result.get('reverse') and attempt < self.max_requeue:
+                        wait_seconds = self.backoff * 2 ** attempt
+                        print(f'{link}重新排队，{wait_seconds}s后重试')
+                        heapq.heappush(delayed, (time.monotonic() + wait_seconds, next(counter), link, attempt + 1))
+                        continue
+                    yield result
+
+
+if __name__ == '__main__':
+    # 用法：python bilibili_batch_crawler.py links.txt result.jsonl [cookies] [metadata|audio|full]
+    links_path, result_path = sys.argv[1], sys.argv[2]
+    cookies = sys.argv[3] if len(sys.argv) > 3 else ''
+    mode = sys.argv[4] if len(sys.argv) > 4 else 'full'
+    crawler = BilibiliBatchCrawler(cookies, mode=mode)
+    with open(links_path, encoding='utf-8') as links_file, open(result_path, 'a', encoding='utf-8') as result_file:
+        links = (line.strip() for line in links_file if line.strip())
+        for result_json in crawler.run(links):
+            result_file.write(json.dumps(result_json, ensure_ascii=False) + '\n')
+            result_file.flush()
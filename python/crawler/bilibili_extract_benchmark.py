@@ -0,0 +1,187 @@
+import json
+import os
+import random
+import re
+import sys
+import time
+
+from bilibili_video_crawler import extract_page_json, request_web_home
+
+WORDS = ['哔哩哔哩', '视频', '教程', '开箱', '测评', '日常', 'vlog', 'Python', '游戏', '音乐', '翻唱', '美食',
+         '旅行', '科普', '一起来看', '第一次', '😀', '🎮', '“引号”', '\\"转义\\"', '换行\\n', '100%', '#话题#']
+
+
+def extract_page_json_bs4(text):
+    """
+    原来基于BeautifulSoup的解析方式，会删掉JSON字符串里的空格，仅用于对比测试
+    """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(text, 'html.parser')
+    scripts = [script for script in soup.find_all('script') if
+               'window.__playinfo__' in script.text or 'window.__INITIAL_STATE__' in script.text]
+    play_info_json = None
+    state_info_json = None
+    for script in scripts:
+        if 'window.__playinfo__' in script.text:
+            play_info = re.findall(r'window.__playinfo__=(.*?)</', str(script).replace(' ', ''))
+            if play_info:
+                play_info_json = json.loads(play_info[0])
+        if 'window.__INITIAL_STATE__' in script.text:
+            STATE_info = re.findall(r'window.__INITIAL_STATE__=(.*?)};', str(script).replace(' ', ''))
+            if STATE_info:
+                state_info_json = json.loads(STATE_info[0] + "}")
+    return play_info_json, state_info_json
+
+
+def random_text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def page_shell(rng, scripts):
+    """
+    页面外壳：和线上页面一样有大量meta、样式、普通脚本和DOM，要找的两段JSON夹在中间
+    """
+    head = ''.join(f'<meta name="spm_prefix_{i}" content="{rng.randrange(10 ** 8)}">' for i in range(40))
+    head += '<style>' + ''.join(f'.c{i}{{margin:{i}px;padding:{i % 7}px}}' for i in range(800)) + '</style>'
+    head += ''.join(f'<script src="//s1.hdslb.com/bfs/static/jinkela/video/{rng.randrange(10 ** 8):x}.js">'
+                    f'</script>' for i in range(20))
+    body = ''.join(f'<div class="item c{i}"><a href="/video/BV{rng.randrange(10 ** 9)}">{random_text(rng, 4)}</a>'
+                   f'<span class="count">{rng.randrange(10 ** 6)}</span></div>' for i in range(600))
+    inline = '<script>window.__BILI_CONFIG__={"abtest":{"a":1},"spm":"333.788"};</script>'
+    return (f'<!DOCTYPE html><html lang="zh-CN"><head><meta charset="UTF-8"><title>{random_text(rng, 3)}</title>'
+            f'{head}</head><body><div id="app">{body}</div>{inline}{scripts}</body></html>')
+
+
+def dash_streams(rng, duration, base_id):
+    videos = []
+    for quality, height in ((80, 1080), (64, 720), (32, 480), (16, 360)):
+        for codecs, codecid in (('avc1.640032', 7), ('hev1.1.6.L150.90', 12), ('av01.0.08M.08.0.110.01.01.01.0', 13)):
+            url = f'https://upos-sz-mirrorcos.bilivideo.com/upgcxcode/{base_id}/{base_id}-1-{quality}{codecid}.m4s'
+            videos.append({'id': quality, 'baseUrl': url, 'base_url': url,
+                           'backupUrl': [url.replace('mirrorcos', 'mirrorali')],
+                           'backup_url': [url.replace('mirrorcos', 'mirrorali')],
+                           'bandwidth': rng.randrange(200000, 3000000), 'mimeType': 'video/mp4', 'codecs': codecs,
+                           'width': height * 16 // 9, 'height': height, 'frameRate': '30.000', 'sar': '1:1',
+                           'startWithSap': 1, 'SegmentBase': {'Initialization': '0-1000', 'indexRange': '1001-2000'},
+                           'codecid': codecid})
+    audios = []
+    for audio_id, bandwidth in ((30280, 192000), (30232, 132000), (30216, 64000)):
+        url = f'https://upos-sz-mirrorcos.bilivideo.com/upgcxcode/{base_id}/{base_id}-1-{audio_id}.m4s'
+        audios.append({'id': audio_id, 'baseUrl': url, 'base_url': url, 'backupUrl': [url], 'backup_url': [url],
+                       'bandwidth': bandwidth, 'mimeType': 'audio/mp4', 'codecs': 'mp4a.40.2', 'codecid': 0})
+    return {'duration': duration, 'minBufferTime': 1.5, 'min_buffer_time': 1.5, 'video': videos, 'audio': audios,
+            'dolby': {'type': 0, 'audio': None}, 'flac': None}
+
+
+def video_page(rng, index):
+    bvid = f'BV1{index:09d}'
+    duration = rng.randrange(10, 3600)
+    play_info = {'code': 0, 'message': '0', 'ttl': 1,
+                 'data': {'from': 'local', 'result': 'suee', 'quality': 64, 'format': 'flv720',
+                          'timelength': duration * 1000,
+                          'accept_description': ['高清 1080P', '高清 720P', '清晰 480P', '流畅 360P'],
+                          'accept_quality': [80, 64, 32, 16], 'video_codecid': 7, 'seek_param': 'start',
+                          'dash': dash_streams(rng, duration, rng.randrange(10 ** 9))}}
+    state = {'aid': index, 'bvid': bvid, 'p': 1,
+             'upData': {'mid': str(rng.randrange(10 ** 9)), 'name': random_text(rng, 2),
+                        'sign': random_text(rng, 8), 'fans': rng.randrange(10 ** 7)},
+             'videoData': {'bvid': bvid, 'title': random_text(rng, 5), 'desc': random_text(rng, 60),
+                           'pubdate': rng.randrange(1500000000, 1760000000), 'duration': duration,
+                           'stat': {'view': rng.randrange(10 ** 7), 'like': rng.randrange(10 ** 6)},
+                           'pages': [{'cid': rng.randrange(10 ** 9), 'page': 1, 'part': random_text(rng, 3)}]},
+             'related': [{'bvid': f'BV1{rng.randrange(10 ** 9):09d}', 'title': random_text(rng, 5),
+                          'owner': {'name': random_text(rng, 2)}} for _ in range(40)],
+             'tags': [{'tag_name': random_text(rng, 1)} for _ in range(10)]}
+    scripts = (f'<script>window.__playinfo__={json.dumps(play_info, ensure_ascii=False)}</script>'
+               f'<script>window.__INITIAL_STATE__={json.dumps(state, ensure_ascii=False)};(function(){{var s;'
+               f'(s=document.currentScript||document.scripts[document.scripts.length-1]).parentNode.removeChild(s);'
+               f'}}());</script>')
+    return page_shell(rng, scripts)
+
+
+def opus_page(rng, index):
+    paragraphs = []
+    for i in range(rng.randrange(3, 12)):
+        if i % 3 == 2:
+            paragraphs.append({'para_type': 2, 'pic': {'pics': [{'url': f'https://i0.hdslb.com/bfs/new_dyn/{i}.jpg',
+                                                                  'width': 1080, 'height': 1440, 'size': 321.5}]}})
+        else:
+            paragraphs.append({'para_type': 1, 'text': {'nodes': [{'type': 'TEXT_NODE_TYPE_WORD', 'word': {
+                'words': random_text(rng, 20), 'font_size': 17, 'style': {}}}]}})
+    state = {'id': str(10 ** 17 + index), 'detail': {'id_str': str(10 ** 17 + index), 'type': 1, 'modules': [
+        {'module_type': 'MODULE_TYPE_AUTHOR', 'module_author': {
+            'mid': rng.randrange(10 ** 9), 'name': random_text(rng, 2), 'pub_ts': rng.randrange(1500000000, 1760000000),
+            'face': 'https://i0.hdslb.com/bfs/face/member/noface.jpg'}},
+        {'module_type': 'MODULE_TYPE_CONTENT', 'module_content': {'paragraphs': paragraphs}},
+        {'module_type': 'MODULE_TYPE_STAT', 'module_stat': {'like': {'count': rng.randrange(10 ** 5)}}},
+    ]}}
+    scripts = (f'<script>window.__INITIAL_STATE__={json.dumps(state, ensure_ascii=False)};(function(){{var s;'
+               f'(s=document.currentScript||document.scripts[document.scripts.length-1]).parentNode.removeChild(s);'
+               f'}}());</script>')
+    return page_shell(rng, scripts)
+
+
+def build_page_corpus(corpus_dir, count=50, seed=0):
+    """
+    生成结构和线上一致的视频页、动态页各count个（字段、嵌套、页面外壳按线上页面构造，内容随机），
+    没有保存下来的真实页面时用来做对比测试
+    """
+    if not os.path.exists(corpus_dir):
+        os.makedirs(corpus_dir)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        for kind, build in (('video', video_page), ('opus', opus_page)):
+            path = os.path.join(corpus_dir, f'{kind}_{i}.html')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(build(rng, i))
+            paths.append(path)
+    return paths
+
+
+def save_page_corpus(links, corpus_dir, cookie=''):
+    """
+    把线上的视频页、动态页保存下来作为对比测试的语料，返回保存的文件路径
+    """
+    if not os.path.exists(corpus_dir):
+        os.makedirs(corpus_dir)
+    paths = []
+    for i, link in enumerate(links):
+        response = request_web_home(link, cookie, fresh=True)
+        if response is None or response.status_code != 200:
+            print(f'{link}保存失败')
+            continue
+        path = os.path.join(corpus_dir, f'page_{i}.html')
+        with open(path, 'wb') as f:
+            f.write(response.content)
+        paths.append(path)
+    return paths
+
+
+def benchmark_extract(page_paths):
+    """
+    用保存下来的视频页、动态页对比两种解析方式的耗时，并检查结果（忽略空格差异）是否一致
+    """
+    pages = []
+    for page_path in page_paths:
+        with open(page_path, 'rb') as f:
+            pages.append(f.read())
+    start = time.perf_counter()
+    old_results = [extract_page_json_bs4(page.decode('utf-8')) for page in pages]
+    old_cost = time.perf_counter() - start
+    start = time.perf_counter()
+    new_results = [extract_page_json(page) for page in pages]
+    new_cost = time.perf_counter() - start
+    mismatches = [page_path for page_path, old, new in zip(page_paths, old_results, new_results)
+                  if json.dumps(old, ensure_ascii=False).replace(' ', '') !=
+                  json.dumps(new, ensure_ascii=False).replace(' ', '')]
+    size = sum(len(page) for page in pages) / 1024 / 1024
+    print(f"{len(pages)}个页面（{size:.1f}MB） BeautifulSoup: {old_cost:.3f}s, 字节扫描: {new_cost:.3f}s, "
+          f"提速 {old_cost / new_cost:.1f}x, 结果不一致的页面: {mismatches}")
+    return old_cost, new_cost, mismatches
+
+
+if __name__ == '__main__':
+    # 用法：python bilibili_extract_benchmark.py [保存的页面...]，不传页面时用生成的语料
+    paths = sys.argv[1:] or build_page_corpus(os.path.join('bilibili_static', 'page_corpus'))
+    benchmark_extract(paths)
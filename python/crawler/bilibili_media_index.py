@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from crawler_common import SqliteStore
+
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class MediaIndex(SqliteStore):
+    """
+    已下载资源的本地索引（SQLite）
+    media表按(note_id, 类型, 序号)记录最终文件的路径、大小、时长和sha256；
+    posts表按链接记录抓取结果，再次抓取同一链接时不需要任何网络请求
+    """
+
+    def __init__(self, db_path):
+        super().__init__(db_path, '''
+            CREATE TABLE IF NOT EXISTS media (
+                note_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                source_url TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                duration INTEGER,
+                sha256 TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (note_id, kind, position)
+            );
+            CREATE INDEX IF NOT EXISTS media_source_url ON media (source_url);
+            CREATE TABLE IF NOT EXISTS posts (
+                source_url TEXT PRIMARY KEY,
+                note_id TEXT NOT NULL,
+                result TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+        ''')
+
+    @staticmethod
+    def is_intact(file_path, size):
+        """
+        文件存在且大小与记录一致
+        """
+        return os.path.exists(file_path) and os.path.getsize(file_path) == size
+
+    def get_media(self, note_id, kind, position=0):
+        """
+        返回完好的文件路径和时长，文件缺失或被截断时返回None
+        """
+        rows = self._query('SELECT file_path, size, duration FROM media WHERE note_id=? AND kind=? AND position=?',
+                           (note_id, kind, position))
+        if not rows or not self.is_intact(rows[0][0], rows[0][1]):
+            return None
+        return rows[0][0], rows[0][2]
+
+    def add_media(self, note_id, kind, source_url, file_path, position=0, duration=None):
+        self._execute('INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                      (note_id, kind, position, source_url, file_path, os.path.getsize(file_path),
+                       duration or None, file_sha256(file_path), datetime.now().isoformat()))
+
+    def get_post(self, source_url):
+        """
+        返回链接上次的抓取结果，结果里任意一个资源文件缺失或被截断时返回None
+        """
+        rows = self._query('SELECT note_id, result FROM posts WHERE source_url=?', (source_url,))
+        if not rows:
+            return None
+        for file_path, size in self._query('SELECT file_path, size FROM media WHERE note_id=?', (rows[0][0],)):
+            if not self.is_intact(file_path, size):
+                return None
+        return json.loads(rows[0][1])
+
+    def add_post(self, source_url, note_id, result):
+        self._execute('INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?)',
+                      (source_url, note_id, json.dumps(result, ensure_ascii=False), datetime.now().isoformat()))
+
+    def broken_media(self, check_hash=False):
+        """
+        完整性检查：返回有资源文件缺失、被截断（check_hash为True时还包括内容被改动）的(链接, 资源类型)，
+        链接取自坏掉的资源记录本身，audio模式抓的音频、有图片下载失败的动态也会包括在内；
+        同时删掉这些坏掉的资源记录和对应的抓取结果，重新抓取时只会重新下载它们
+        """
+        broken = []
+        broken_notes = set()
+        rows = self._query('SELECT note_id, kind, position, source_url, file_path, size, sha256 FROM media')
+        for note_id, kind, position, source_url, file_path, size, sha256 in rows:
+            intact = self.is_intact(file_path, size)
+            if intact and check_hash:
+                intact = file_sha256(file_path) == sha256
+            if not intact:
+                broken_notes.add(note_id)
+                if (source_url, kind) not in broken:
+                    broken.append((source_url, kind))
+                self._execute('DELETE FROM media WHERE note_id=? AND kind=? AND position=?', (note_id, kind, position))
+        for note_id in broken_notes:
+            self._execute('DELETE FROM posts WHERE note_id=?', (note_id,))
+        return broken
@@ -0,0 +1,98 @@
+import time
+import zlib
+
+from crawler_common import SqliteStore
+
+
+class CachedResponse:
+    """
+    从缓存取出的页面，提供build_video_json用到的content/status_code/text等属性
+    """
+
+    def __init__(self, url, content, headers=None, status_code=200):
+        self.url = url
+        self.content = content
+        self.headers = headers or {}
+        self.status_code = status_code
+        self.encoding = 'utf-8'
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors='replace')
+
+
+class PageCache(SqliteStore):
+    """
+    页面的本地HTTP缓存（SQLite）
+    按链接保存zlib压缩后的页面和ETag/Last-Modified；ttl秒内的页面直接使用，
+    过期后带If-None-Match/If-Modified-Since请求，服务端返回304时继续使用缓存的内容
+    """
+
+    def __init__(self, db_path, ttl=0, level=6):
+        super().__init__(db_path, '''
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                final_url TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                body BLOB NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+        ''')
+        self.ttl = ttl
+        self.level = level
+
+    def get(self, url):
+        """
+        返回(缓存的页面, 缓存时间)，没有缓存返回None
+        """
+        rows = self._query('SELECT final_url, etag, last_modified, body, fetched_at FROM pages WHERE url=?', (url,))
+        if not rows:
+            return None
+        final_url, etag, last_modified, body, fetched_at = rows[0]
+        headers = {}
+        if etag:
+            headers['ETag'] = etag
+        if last_modified:
+            headers['Last-Modified'] = last_modified
+        return CachedResponse(final_url, zlib.decompress(body), headers), fetched_at
+
+    def is_fresh(self, fetched_at, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        return ttl is not None and time.time() - fetched_at < ttl
+
+    @staticmethod
+    def conditional_headers(cached):
+        """
+        重新请求时带上的条件请求头
+        """
+        headers = {}
+        if cached.headers.get('ETag'):
+            headers['If-None-Match'] = cached.headers['ETag']
+        if cached.headers.get('Last-Modified'):
+            headers['If-Modified-Since'] = cached.headers['Last-Modified']
+        return headers
+
+    def put(self, url, response):
+        self._execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                      (url, response.url or url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                       zlib.compress(response.content, self.level), time.time()))
+
+    def touch(self, url):
+        """
+        服务端返回304，页面没变，只刷新缓存时间
+        """
+        self._execute('UPDATE pages SET fetched_at=? WHERE url=?', (time.time(), url))
+
+    def urls(self):
+        return [row[0] for row in self._query('SELECT url FROM pages ORDER BY url')]
+
+    def items(self):
+        """
+        逐个返回(链接, 缓存的页面)，用于不联网重新解析所有缓存的页面
+        """
+        for url in self.urls():
+            cached = self.get(url)
+            if cached:
+                yield url, cached[0]
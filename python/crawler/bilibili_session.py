@@ -0,0 +1,223 @@
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 所有请求共用的浏览器请求头
+BASE_HEADERS = {
+    'accept-language': 'zh-CN,zh;q=0.9,en-US;q=0.8,en;q=0.7',
+    'sec-ch-ua': '"Not)A;Brand";v="99", "Google Chrome";v="127", "Chromium";v="127"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"Windows"',
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36',
+}
+
+
+def cookie_dict(cookie):
+    """
+    把浏览器复制出来的cookie字符串转成字典，作为请求的cookies参数和会话里的cookie合并
+    """
+    cookies = {}
+    for item in (cookie or '').split(';'):
+        name, sep, value = item.strip().partition('=')
+        if sep and name:
+            cookies[name] = value
+    return cookies
+
+
+# 表示被限流的状态码
+THROTTLE_STATUS = (429, 503)
+
+
+def parse_retry_after(value):
+    """
+    解析Retry-After头，支持秒数和HTTP日期两种格式，返回需要等待的秒数
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    单个域名的令牌桶，速率按AIMD调整：每次正常响应加increase，每次被限流乘以decrease
+    """
+
+    def __init__(self, rate=5.0, burst=5, min_rate=0.2, max_rate=50.0, increase=0.1, decrease=0.5):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait_seconds = self.blocked_until - now
+                if wait_seconds <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = 0
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+
+class AdaptiveRateLimiter:
+    """
+    按域名限速，只根据状态码和Retry-After头判断是否被限流，不读取响应内容
+    """
+
+    def __init__(self, **bucket_options):
+        self.bucket_options = bucket_options
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, host):
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(**self.bucket_options)
+            return bucket
+
+    def acquire(self, host):
+        self.bucket(host).acquire()
+
+    def record(self, host, response):
+        if response.status_code in THROTTLE_STATUS:
+            self.bucket(host).on_throttle(parse_retry_after(response.headers.get('Retry-After')))
+        elif response.status_code < 500:
+            self.bucket(host).on_success()
+
+    def rates(self):
+        """
+        各域名当前的速率（次/秒）和累计被限流次数
+        """
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {host: {'rate': round(bucket.rate, 3), 'throttled': bucket.throttled}
+                for host, bucket in buckets.items()}
+
+
+class SessionPool:
+    """
+    进程内共享的HTTP会话池
+    每个线程一个Session（请求头、cookie状态互不干扰），但都挂载同一组HTTPAdapter，
+    TCP/TLS连接在线程之间、在多次bilibili_crawl调用之间复用；服务端下发的cookie存在共享的cookie jar里
+    host_limits可以给指定域名单独设置最大连接数，连接用满时请求会等待空闲连接
+    timeout是没有单独传timeout的请求的默认超时（连接超时, 读超时），避免卡住的连接一直占着连接池和并发名额
+    """
+
+    def __init__(self, headers=None, pool_maxsize=32, host_limits=None, max_retries=3, rate_limiter=None,
+                 timeout=(10, 30)):
+        self.headers = dict(headers or BASE_HEADERS)
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.cookies = requests.cookies.RequestsCookieJar()
+        # 429/503不在urllib3里按Retry-After自动重试，交给限速器处理
+        max_retries = Retry(total=max_retries, respect_retry_after_header=False)
+        self.adapter = HTTPAdapter(pool_connections=20, pool_maxsize=pool_maxsize, max_retries=max_retries)
+        self.host_adapters = {}
+        for host, limit in (host_limits or {}).items():
+            self.host_adapters[host] = HTTPAdapter(pool_connections=1, pool_maxsize=limit, pool_block=True,
+                                                   max_retries=max_retries)
+        self._local = threading.local()
+
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.session()
+            session.headers.update(self.headers)
+            session.cookies = self.cookies
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            for host, adapter in self.host_adapters.items():
+                session.mount(f'http://{host}/', adapter)
+                session.mount(f'https://{host}/', adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method, url, cookie=None, **kwargs):
+        """
+        cookie字符串可以用cookie参数传，也可以放在headers的cookie里，都会和共享的cookie jar合并后发送
+        """
+        headers = kwargs.get('headers')
+        if headers:
+            for name in [name for name in headers if name.lower() == 'cookie']:
+                cookie = cookie or headers[name]
+                kwargs['headers'] = headers = {k: v for k, v in headers.items() if k != name}
+        if cookie:
+            kwargs['cookies'] = dict(cookie_dict(cookie), **(kwargs.get('cookies') or {}))
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlparse(url).hostname
+        self.rate_limiter.acquire(host)
+        response = self.session().request(method, url, **kwargs)
+        self.rate_limiter.record(host, response)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def stats(self):
+        """
+        按域名统计新建连接数和请求数，reused是复用已有连接的请求数（省掉的握手次数）
+        """
+        result = {}
+        for adapter in [self.adapter] + list(self.host_adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                stat = result.setdefault(pool.host, {'connections': 0, 'requests': 0, 'reused': 0})
+                stat['connections'] += pool.num_connections
+                stat['requests'] += pool.num_requests
+                stat['reused'] += max(pool.num_requests - pool.num_connections, 0)
+        return result
+
+    def close(self):
+        self.adapter.close()
+        for adapter in self.host_adapters.values():
+            adapter.close()
+
+
+if __name__ == '__main__':
+    pool = SessionPool(host_limits={'www.bilibili.com': 4})
+    for _ in range(3):
+        pool.get('https://www.bilibili.com/', timeout=10).close()
+    print(pool.stats())
+    print(pool.rate_limiter.rates())
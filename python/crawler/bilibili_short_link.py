@@ -0,0 +1,158 @@
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, urljoin, urlparse
+
+from bilibili_session import SessionPool
+from crawler_common import SqliteStore
+
+SHORT_LINK_HOSTS = ('b23.tv', 'www.b23.tv', 'bili2233.cn')
+BVID_PATTERN = re.compile(r'BV[0-9A-Za-z]{10}')
+OPUS_PATTERN = re.compile(r'^/opus/(\d+)|^/(\d+)$')
+READ_PATTERN = re.compile(r'/read/(cv\d+)')
+
+
+def video_part(url):
+    """
+    多P视频链接里的分P序号，没有p参数时为1
+    """
+    part = parse_qs(urlparse(url).query).get('p', [''])[0]
+    return int(part) if part.isdigit() and int(part) > 0 else 1
+
+
+def canonical_url(url):
+    """
+    把视频、动态、专栏链接统一成标准链接，识别不了返回None
+    只保留多P视频的分P参数p（p=1和不带p是同一个视频），其他参数都去掉
+    """
+    parsed = urlparse(url)
+    if not parsed.hostname or not parsed.hostname.endswith('bilibili.com'):
+        return None
+    match = BVID_PATTERN.search(parsed.path)
+    if match:
+        part = video_part(url)
+        if part > 1:
+            return f'https://www.bilibili.com/video/{match.group(0)}?p={part}'
+        return f'https://www.bilibili.com/video/{match.group(0)}'
+    match = OPUS_PATTERN.search(parsed.path)
+    if match and (parsed.path.startswith('/opus/') or parsed.hostname == 't.bilibili.com'):
+        return f'https://www.bilibili.com/opus/{match.group(1) or match.group(2)}'
+    match = READ_PATTERN.search(parsed.path)
+    if match:
+        return f'https://www.bilibili.com/read/{match.group(1)}'
+    return None
+
+
+def is_short_link(url):
+    return urlparse(url).hostname in SHORT_LINK_HOSTS
+
+
+class ShortLinkResolver(SqliteStore):
+    """
+    b23.tv短链解析
+    只跟随跳转的Location头，不下载页面内容；解析结果先放内存LRU，再存到SQLite，
+    同一个短链以后不需要再请求
+    """
+
+    def __init__(self, db_path, session=None, cache_size=4096, workers=16, max_redirects=5, timeout=10):
+        super().__init__(db_path, '''
+            CREATE TABLE IF NOT EXISTS short_links (
+                short_url TEXT PRIMARY KEY,
+                canonical_url TEXT NOT NULL,
+                resolved_at TEXT NOT NULL
+            );
+        ''')
+        self.session = session or SessionPool()
+        self.cache_size = cache_size
+        self.workers = workers
+        self.max_redirects = max_redirects
+        self.timeout = timeout
+        self._lru = OrderedDict()
+
+    def _remember(self, short_url, canonical):
+        self._lru[short_url] = canonical
+        self._lru.move_to_end(short_url)
+        while len(self._lru) > self.cache_size:
+            self._lru.popitem(last=False)
+
+    def cached(self, short_url):
+        with self._lock:
+            canonical = self._lru.get(short_url)
+            if canonical:
+                self._lru.move_to_end(short_url)
+                return canonical
+            row = self.conn.execute('SELECT canonical_url FROM short_links WHERE short_url=?',
+                                    (short_url,)).fetchone()
+            if row:
+                self._remember(short_url, row[0])
+                return row[0]
+        return None
+
+    def store(self, short_url, canonical):
+        with self._lock:
+            self._remember(short_url, canonical)
+            self.conn.execute('INSERT OR REPLACE INTO short_links VALUES (?, ?, ?)',
+                              (short_url, canonical, datetime.now().isoformat()))
+            self.conn.commit()
+
+    def follow(self, url):
+        """
+        逐跳请求，只读状态码和Location头，遇到能识别的链接就停止；返回最终链接
+        """
+        for _ in range(self.max_redirects):
+            if canonical_url(url):
+                return url
+            with self.session.get(url, allow_redirects=False, stream=True, timeout=self.timeout) as response:
+                location = response.headers.get('Location')
+                if not response.is_redirect or not location:
+                    return url
+            url = urljoin(url, location)
+        return url
+
+    def resolve(self, url, offline=False):
+        """
+        返回标准链接；不是短链的链接直接规范化，解析失败返回原链接
+        offline为True时只查已经解析过的结果，不发请求
+        """
+        url = url.strip()
+        if not is_short_link(url):
+            return canonical_url(url) or url
+        canonical = self.cached(url)
+        if canonical:
+            return canonical
+        if offline:
+            return url
+        try:
+            canonical = canonical_url(self.follow(url))
+        except Exception as e:
+            print(f'短链解析失败 {url}', e)
+            return url
+        if not canonical:
+            print(f'短链没有跳转到视频或动态 {url}')
+            return url
+        self.store(url, canonical)
+        return canonical
+
+    def resolve_many(self, urls, offline=False):
+        """
+        并发解析一批链接，返回{原链接: 标准链接}，重复的短链只请求一次
+        """
+        unique = list(dict.fromkeys(url.strip() for url in urls))
+        with ThreadPoolExecutor(max_workers=max(min(self.workers, len(unique)), 1)) as executor:
+            return dict(zip(unique, executor.map(lambda url: self.resolve(url, offline), unique)))
+
+
+if __name__ == '__main__':
+    cases = {
+        'https://www.bilibili.com/video/BV1xx411c7mD/?share_source=copy_web': 'https://www.bilibili.com/video/BV1xx411c7mD',
+        'https://m.bilibili.com/video/BV1xx411c7mD?p=1': 'https://www.bilibili.com/video/BV1xx411c7mD',
+        'https://www.bilibili.com/video/BV1xx411c7mD?p=3&share_medium=android': 'https://www.bilibili.com/video/BV1xx411c7mD?p=3',
+        'https://t.bilibili.com/12345': 'https://www.bilibili.com/opus/12345',
+        'https://www.bilibili.com/opus/12345?spm_id_from=1': 'https://www.bilibili.com/opus/12345',
+        'https://www.bilibili.com/read/cv678': 'https://www.bilibili.com/read/cv678',
+        'https://example.com/video/BV1xx411c7mD': None,
+    }
+    for url, expected in cases.items():
+        assert canonical_url(url) == expected, (url, canonical_url(url))
+    print(f'{len(cases)}个链接规范化结果正确')
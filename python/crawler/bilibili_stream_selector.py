@@ -0,0 +1,74 @@
+class StreamPolicy:
+    """
+    DASH流的选择策略
+    codecs是可以接受的编码前缀（如avc1、hev1、av01、mp4a），min_height/max_height限制分辨率（音频不用），
+    prefer为lowest时选码率最低的，为highest时选码率最高的；
+    没有完全满足的流时，依次放宽分辨率、编码的限制，保证有流可选
+    """
+
+    def __init__(self, codecs=('avc1',), min_height=0, max_height=None, prefer='lowest'):
+        if prefer not in ('lowest', 'highest'):
+            raise ValueError(f'prefer只能是lowest或highest：{prefer}')
+        self.codecs = tuple(codecs or ())
+        self.min_height = min_height
+        self.max_height = max_height
+        self.prefer = prefer
+
+    def codec_ok(self, stream):
+        return not self.codecs or (stream.get('codecs') or '').startswith(self.codecs)
+
+    def height_ok(self, stream):
+        height = stream.get('height') or 0
+        return height >= self.min_height and (self.max_height is None or height <= self.max_height)
+
+    def rank(self, streams):
+        """
+        按策略排序，第一个就是选中的流
+        """
+        reverse = self.prefer == 'highest'
+        by_bandwidth = sorted(streams, key=lambda stream: stream.get('bandwidth') or 0, reverse=reverse)
+        matched = [stream for stream in by_bandwidth if self.codec_ok(stream) and self.height_ok(stream)]
+        # 编码符合但分辨率都不够时，取最接近要求的（分辨率最高的）
+        codec_only = sorted([stream for stream in by_bandwidth if self.codec_ok(stream) and stream not in matched],
+                            key=lambda stream: stream.get('height') or 0, reverse=True)
+        rest = [stream for stream in by_bandwidth if stream not in matched and stream not in codec_only]
+        return matched + codec_only + rest
+
+    def select(self, streams):
+        ranked = self.rank(streams or [])
+        return ranked[0] if ranked else None
+
+
+# 默认：不低于480p的体积最小的AVC视频，码率最低的AAC音频
+VIDEO_POLICY = StreamPolicy(codecs=('avc1',), min_height=480, prefer='lowest')
+AUDIO_POLICY = StreamPolicy(codecs=('mp4a',), prefer='lowest')
+
+
+def stream_urls(stream):
+    """
+    主地址加上备用镜像地址，页面里两种命名都有
+    """
+    if not stream:
+        return []
+    urls = [stream.get('base_url') or stream.get('baseUrl')]
+    urls.extend(stream.get('backup_url') or stream.get('backupUrl') or [])
+    return [url for url in dict.fromkeys(urls) if url]
+
+
+def expected_bytes(stream, duration):
+    """
+    按码率（bit/s）和时长估算流的字节数
+    """
+    if not stream or not stream.get('bandwidth') or not duration:
+        return 0
+    return int(stream['bandwidth'] * duration / 8)
+
+
+def select_streams(dash, video_policy=None, audio_policy=None):
+    """
+    从playinfo的dash里选出视频流和音频流，返回(视频流, 音频流)，没有时对应位置为None
+    """
+    dash = dash or {}
+    video = (video_policy or VIDEO_POLICY).select(dash.get('video'))
+    audio = (audio_policy or AUDIO_POLICY).select(dash.get('audio'))
+    return video, audio
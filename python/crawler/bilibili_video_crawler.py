@@ -2,36 +2,335 @@ import datetime
 import json
 import re
 import os.path
+import struct
 import time
-import uuid
 import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
-from bs4 import BeautifulSoup
-from moviepy.editor import VideoFileClip, AudioFileClip
-import requests
-from requests.adapters import HTTPAdapter
+import imageio_ffmpeg
 from datetime import datetime
 
+from bilibili_media_index import MediaIndex
+from bilibili_page_cache import PageCache
+from bilibili_session import THROTTLE_STATUS, SessionPool
+from bilibili_short_link import ShortLinkResolver, is_short_link, video_part
+from bilibili_stream_selector import expected_bytes, select_streams, stream_urls
+from segment_downloader import SegmentDownloader
 
-def download(response, base_dir, file_name):
+# 进程内共享的会话池，页面和CDN的连接在多次bilibili_crawl之间复用
+SESSION_POOL = SessionPool(host_limits={'www.bilibili.com': 4})
+# DASH音视频流分段并发下载
+SEGMENT_DOWNLOADER = SegmentDownloader(connections=4, session=SESSION_POOL)
+# 页面请求、资源下载、音视频合并各自的并发上限，批量抓取时通过set_concurrency_limits调整
+PAGE_SEMAPHORE = threading.BoundedSemaphore(8)
+DOWNLOAD_SEMAPHORE = threading.BoundedSemaphore(8)
+MUX_SEMAPHORE = threading.BoundedSemaphore(4)
+# 每条动态同时下载的图片数
+IMAGE_WORKERS_PER_POST = 6
+# 已下载资源的索引、页面缓存、b23.tv短链映射存放的目录，第一次用到时才创建数据库
+STORAGE_DIR = 'bilibili_static'
+# 页面缓存的有效期（秒），有效期内不发请求，过期后发条件请求
+PAGE_CACHE_TTL = 0
+_storage = {}
+_storage_lock = threading.Lock()
+# 正在下载资源的note_id：{note_id: [锁, 使用数]}，同一个视频或动态的临时文件和合并输出同一时间只有一个抓取在写
+_note_locks = {}
+_note_locks_lock = threading.Lock()
+
+
+def set_concurrency_limits(page=8, download=8, mux=4):
+    global PAGE_SEMAPHORE, DOWNLOAD_SEMAPHORE, MUX_SEMAPHORE
+    PAGE_SEMAPHORE = threading.BoundedSemaphore(page)
+    DOWNLOAD_SEMAPHORE = threading.BoundedSemaphore(download)
+    MUX_SEMAPHORE = threading.BoundedSemaphore(mux)
+
+
+def configure_storage(base_dir='bilibili_static'):
+    """
+    修改索引、缓存数据库的目录，需要在开始抓取之前调用；已经打开的数据库会关闭，下次用到时在新目录重新打开
+    """
+    global STORAGE_DIR
+    with _storage_lock:
+        for storage in _storage.values():
+            storage.close()
+        _storage.clear()
+        STORAGE_DIR = base_dir
+
+
+def set_page_cache_ttl(ttl):
+    global PAGE_CACHE_TTL
+    PAGE_CACHE_TTL = ttl
+    with _storage_lock:
+        if 'page_cache' in _storage:
+            _storage['page_cache'].ttl = ttl
+
+
+def _open_storage(name, factory):
+    with _storage_lock:
+        if name not in _storage:
+            _storage[name] = factory()
+        return _storage[name]
+
+
+@contextmanager
+def note_lock(note_id):
+    """
+    同一个note_id的资源下载、合并串行执行；后进来的抓取等前一个完成后再查索引，下载好的文件直接复用
+    """
+    with _note_locks_lock:
+        entry = _note_locks.setdefault(note_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _note_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _note_locks[note_id]
+
+
+def media_index():
+    """
+    已下载资源的索引，重复抓取时跳过已经下载好的文件
+    """
+    return _open_storage('media_index', lambda: MediaIndex(os.path.join(STORAGE_DIR, 'media_index.db')))
+
+
+def page_cache():
+    """
+    页面缓存，PAGE_CACHE_TTL秒内重复请求同一链接直接用缓存，过期后发条件请求
+    """
+    return _open_storage('page_cache', lambda: PageCache(os.path.join(STORAGE_DIR, 'page_cache.db'),
+                                                         ttl=PAGE_CACHE_TTL))
+
+
+def short_link_resolver():
+    """
+    b23.tv短链到标准链接的映射
+    """
+    return _open_storage('short_link_resolver', lambda: ShortLinkResolver(
+        os.path.join(STORAGE_DIR, 'short_links.db'), session=SESSION_POOL))
+
+
+def download(response, base_dir, file_name, chunk_size=64 * 1024):
+    """
+    流式写入文件：分块写到.part临时文件，下载完整后再改名，内存占用与文件大小无关
+    响应为206时追加到已有的临时文件后面（断点续传）
+    """
     if not os.path.exists(base_dir):
         os.makedirs(base_dir)
+    file_path = os.path.join(base_dir, file_name)
+    temp_path = file_path + '.part'
     try:
         print('资源开始下载')
-        with open(os.path.join(base_dir, file_name), 'wb') as f:
-            f.write(response.content)
+        mode = 'ab' if response.status_code == 206 else 'wb'
+        with open(temp_path, mode) as f:
+            for chunk in response.iter_content(chunk_size):
+                f.write(chunk)
+        # 校验大小：206看Content-Range里的总长度，200看Content-Length（压缩传输时无法比较）
+        expected = response.headers.get('Content-Range', '').rpartition('/')[2]
+        if not expected and not response.headers.get('Content-Encoding'):
+            expected = response.headers.get('Content-Length', '')
+        if expected.isdigit() and os.path.getsize(temp_path) != int(expected):
+            raise IOError(f'文件不完整 {os.path.getsize(temp_path)}/{expected}')
+        os.replace(temp_path, file_path)
         print('资源下载完成')
-        return os.path.join(base_dir, file_name)
+        return file_path
     except Exception as e:
         print('资源下载失败：', e)
         return ''
 
 
+def download_url(session, url, headers, base_dir, file_name):
+    """
+    流式下载url，上次失败留下的.part临时文件用Range请求从断点继续
+    """
+    temp_path = os.path.join(base_dir, file_name) + '.part'
+    if os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
+        headers = dict(headers, Range=f'bytes={os.path.getsize(temp_path)}-')
+    with session.get(url, headers=headers, stream=True) as response:
+        if response.status_code == 416:
+            # 断点位置无效，删掉临时文件，下次重新下载
+            os.remove(temp_path)
+        response.raise_for_status()
+        file_path = download(response, base_dir, file_name)
+    if file_path and os.path.getsize(file_path) < 10:
+        # 内容过短说明拿到的不是资源本身
+        os.remove(file_path)
+        return ''
+    return file_path
+
+
+def download_stream(session, url, headers, base_dir, file_name):
+    """
+    DASH流优先多连接分段下载，服务器不支持Range时退回单连接流式下载
+    """
+    file_path = SEGMENT_DOWNLOADER.download(url, headers, base_dir, file_name)
+    if file_path is None:
+        file_path = download_url(session, url, headers, base_dir, file_name)
+    return file_path
+
+
+def is_throttled(e):
+    """
+    被限流（429/503）时不再固定等待，由会话池的限速器按Retry-After和当前速率安排下一次请求
+    """
+    response = getattr(e, 'response', None)
+    return response is not None and response.status_code in THROTTLE_STATUS
+
+
+def download_stream_with_retry(session, url, headers, base_dir, file_name, times=3, backup_urls=()):
+    """
+    下载单个流，失败单独重试，不影响同时下载的其他流
+    每一轮先试主地址，失败再依次试备用镜像
+    """
+    for i in range(times):
+        throttled = False
+        for candidate in [url, *backup_urls]:
+            try:
+                with DOWNLOAD_SEMAPHORE:
+                    file_path = download_stream(session, candidate, headers, base_dir, file_name)
+                if file_path:
+                    return file_path
+            except Exception as e:
+                print(f'哔哩哔哩下载资源失败 {candidate}', e)
+                throttled = throttled or is_throttled(e)
+        if i < times - 1 and not throttled:
+            time.sleep(5)
+    return ''
+
+
+def mux_copy(video_path, audio_path, output_path):
+    """
+    不解码不重新编码，直接把AVC视频流和AAC音频流复制进MP4容器
+    """
+    temp_path = output_path + '.part'
+    command = [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-loglevel', 'error',
+               '-i', video_path, '-i', audio_path,
+               '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy',
+               '-movflags', '+faststart', '-f', 'mp4', temp_path]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise RuntimeError(result.stderr.decode('utf-8', 'ignore').strip())
+    os.replace(temp_path, output_path)
+
+
+def mux_reencode(video_path, audio_path, output_path):
+    """
+    用moviepy解码后重新编码合并，速度慢，只在直接复制失败且明确允许时使用
+    """
+    from moviepy.editor import VideoFileClip, AudioFileClip
+    # 加载视频和音频文件
+    video = VideoFileClip(video_path)
+    audio = AudioFileClip(audio_path)
+    try:
+        # 将音频合并到视频中
+        final_video = video.set_audio(audio)
+        # 保存输出文件
+        final_video.write_videofile(output_path, codec="libx264", audio_codec="aac")
+    finally:
+        audio.close()
+        video.close()
+
+
+def merge_video_audio(video_path, audio_path, output_path, fallback_reencode=False):
+    """
+    合并音视频：默认直接复制音视频流，失败且fallback_reencode为True时才重新编码
+    """
+    try:
+        mux_copy(video_path, audio_path, output_path)
+    except Exception as e:
+        if not fallback_reencode:
+            raise
+        print('直接复制音视频流失败，改为重新编码', e)
+        mux_reencode(video_path, audio_path, output_path)
+
+
+def read_mp4_boxes(f, end):
+    """
+    遍历[当前位置, end)范围内的MP4 box，返回(类型, 内容起点, box终点)，不读取box内容
+    """
+    while f.tell() + 8 <= end:
+        start = f.tell()
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+        elif size == 0:
+            size = end - start
+        if size < 8:
+            return
+        yield box_type, f.tell(), start + size
+        f.seek(start + size)
+
+
+def read_full_box_version(f, body_start):
+    f.seek(body_start)
+    return f.read(4)[0]
+
+
 def get_video_duration(file_path):
-    video = VideoFileClip(file_path)
-    duration = video.duration
-    video.close()
-    return int(duration)
+    """
+    从MP4的box读取时长（秒），不启动解码进程：
+    普通MP4读moov/mvhd；分片MP4（DASH的m4s/m4a）mvhd里的时长为0或只是第一段，
+    优先读moov/mvex/mehd，没有mehd时把sidx里各分段的时长加起来；都读不到返回''
+    """
+    mvhd = mehd = None
+    # sidx的时间单位和指向媒体分段（不是下一级sidx）的时长之和
+    sidx_timescale = sidx_duration = 0
+    fragmented = False
+    try:
+        with open(file_path, 'rb') as f:
+            for box_type, body_start, box_end in read_mp4_boxes(f, os.path.getsize(file_path)):
+                if box_type == b'moov':
+                    f.seek(body_start)
+                    for child_type, child_start, child_end in read_mp4_boxes(f, box_end):
+                        if child_type == b'mvhd':
+                            if read_full_box_version(f, child_start) == 1:
+                                mvhd = struct.unpack('>16xIQ', f.read(28))
+                            else:
+                                mvhd = struct.unpack('>8xII', f.read(16))
+                        elif child_type == b'mvex':
+                            f.seek(child_start)
+                            for mvex_type, mvex_start, mvex_end in read_mp4_boxes(f, child_end):
+                                if mvex_type == b'mehd':
+                                    if read_full_box_version(f, mvex_start) == 1:
+                                        mehd = struct.unpack('>Q', f.read(8))[0]
+                                    else:
+                                        mehd = struct.unpack('>I', f.read(4))[0]
+                        f.seek(child_end)
+                elif box_type == b'moof':
+                    fragmented = True
+                elif box_type == b'sidx':
+                    version = read_full_box_version(f, body_start)
+                    sidx_timescale = struct.unpack('>4xI', f.read(8))[0]
+                    f.read(16 if version == 1 else 8)
+                    count = struct.unpack('>2xH', f.read(4))[0]
+                    references = f.read(12 * count)
+                    for i in range(count):
+                        reference, subsegment_duration = struct.unpack_from('>II', references, 12 * i)
+                        if not reference >> 31:
+                            sidx_duration += subsegment_duration
+    except Exception as e:
+        print(f'读取视频时长失败 {file_path}', e)
+        return ''
+    timescale = mvhd[0] if mvhd else 0
+    if timescale and mehd:
+        return int(mehd / timescale)
+    if sidx_timescale and sidx_duration:
+        return int(sidx_duration / sidx_timescale)
+    # 分片MP4的mvhd只包含moov里的样本，不是完整时长
+    if timescale and mvhd[1] and not fragmented:
+        return int(mvhd[1] / timescale)
+    return ''
 
 
 def get_yyyymmdd():
@@ -40,22 +339,27 @@ def get_yyyymmdd():
     return yyyymmdd
 
 
-def request_web_home(url, cookie):
+def request_web_home(url, cookie, offline=False, fresh=False):
+    """
+    :param offline: 为True时只从页面缓存取，不发任何请求，没有缓存返回None
+    :param fresh: 为True时不用缓存也不发条件请求，一定重新下载页面（页面里的音视频地址会过期，下载资源前需要新页面）
+    """
+    cache = page_cache()
+    cached = None if fresh else cache.get(url)
+    if cached and (offline or cache.is_fresh(cached[1])):
+        return cached[0]
+    if offline:
+        return None
     headers = {
         'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-        'accept-language': 'zh-CN,zh;q=0.9,en-US;q=0.8,en;q=0.7',
         'cache-control': 'max-age=0',
         'cookie': cookie,
         'priority': 'u=0, i',
-        'sec-ch-ua': '"Not)A;Brand";v="99", "Google Chrome";v="127", "Chromium";v="127"',
-        'sec-ch-ua-mobile': '?0',
-        'sec-ch-ua-platform': '"Windows"',
         'sec-fetch-dest': 'document',
         'sec-fetch-mode': 'navigate',
         'sec-fetch-site': 'same-origin',
         'sec-fetch-user': '?1',
         'upgrade-insecure-requests': '1',
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36',
     }
     i = 0
     while True:
@@ -63,54 +367,93 @@ def request_web_home(url, cookie):
         if i == 3:
             return None
         try:
-            session = requests.session()
-            session.mount('http://', HTTPAdapter(max_retries=3))
-            session.mount('https://', HTTPAdapter(max_retries=3))
-            response = session.get(url, headers=headers)
+            with PAGE_SEMAPHORE:
+                response = SESSION_POOL.get(url, headers=dict(headers, **cache.conditional_headers(cached[0]))
+                                            if cached else headers)
+            if response.status_code in THROTTLE_STATUS:
+                print(f'请求被限流，开始重试 {url}')
+                continue
+            if response.status_code == 304 and cached:
+                # 页面没有变化，用缓存的内容
+                cache.touch(url)
+                return cached[0]
             response.encoding = 'utf-8'
+            if response.status_code == 200:
+                cache.put(url, response)
             return response
         except Exception as e:
             print(f'请求失败，开始重试 {url}', e)
             time.sleep(5)
             continue
-        finally:
-            session.close()
 
 
-def build_video_json(response):
-    soup = BeautifulSoup(response.text, 'html.parser')
-    if soup.text.startswith('{"code"') and json.loads(soup.text)['code'] == -404:
+# JSON中的字符串或括号，字符串整体跳过，里面的括号不参与匹配
+JSON_TOKEN_PATTERN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]')
+PLAY_INFO_PATTERN = re.compile(rb'window\.__playinfo__\s*=\s*')
+INITIAL_STATE_PATTERN = re.compile(rb'window\.__INITIAL_STATE__\s*=\s*')
+
+
+def find_json_end(data, start):
+    """
+    从data[start]处的{或[开始做括号匹配，返回JSON对象结束的位置（不含），找不到返回-1
+    """
+    depth = 0
+    for match in JSON_TOKEN_PATTERN.finditer(data, start):
+        char = data[match.start()]
+        if char == 0x22:
+            continue
+        if char == 0x7b or char == 0x5b:
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    return -1
+
+
+def extract_assigned_json(data, pattern):
+    """
+    在原始页面字节里找到 window.xxx= 赋值的JSON，只解码这一段
+    """
+    match = pattern.search(data)
+    if not match or match.end() >= len(data) or data[match.end()] not in b'{[':
+        return None
+    end = find_json_end(data, match.end())
+    if end < 0:
+        return None
+    return json.loads(data[match.end():end].decode('utf-8'))
+
+
+def extract_page_json(content):
+    """
+    从页面原始字节中取出__playinfo__和__INITIAL_STATE__
+    """
+    return extract_assigned_json(content, PLAY_INFO_PATTERN), extract_assigned_json(content, INITIAL_STATE_PATTERN)
+
+
+def build_video_json(response, video_policy=None, audio_policy=None):
+    """
+    :param video_policy: 视频流的选择策略，默认不低于480p的体积最小的AVC
+    :param audio_policy: 音频流的选择策略，默认码率最低的AAC
+    """
+    content = response.content
+    if content.lstrip().startswith(b'{"code"') and json.loads(content)['code'] == -404:
         return None, 404
-    scripts = [script for script in soup.find_all('script') if
-               'window.__playinfo__' in script.text or 'window.__INITIAL_STATE__' in script.text]
-    # print(response.text)
-    play_info_json = None
-    state_info_json = None
-    for script in scripts:
-        if 'window.__playinfo__' in script.text:
-            play_info = re.findall(r'window.__playinfo__=(.*?)</', str(script).replace(' ', ''))
-            if play_info:
-                play_info_json = json.loads(play_info[0])
-                # print(json.dumps(play_info, ensure_ascii=False))
-        if 'window.__INITIAL_STATE__' in script.text:
-            STATE_info = re.findall(r'window.__INITIAL_STATE__=(.*?)};', str(script).replace(' ', ''))
-            if STATE_info:
-                state_info_json = json.loads(STATE_info[0] + "}")
-                # print(json.dumps(state_info_json, ensure_ascii=False))
-    video_url = ''
+    play_info_json, state_info_json = extract_page_json(content)
+    video_urls = []
+    mp3_urls = []
+    # 时长直接取playinfo里的dash.duration（秒）
+    duration = ''
+    stream_bytes = 0
     if play_info_json and play_info_json.get('data') and play_info_json.get('data').get('dash'):
-        for video in play_info_json['data']['dash']['video']:
-            if (video['id'] == 64 or video['id'] == 32) and 'avc1' in video['codecs']:
-                video_url = video['base_url']
-                break
-    # if video_url == '':
+        dash = play_info_json['data']['dash']
+        duration = dash.get('duration') or ''
+        video, audio = select_streams(dash, video_policy, audio_policy)
+        video_urls = stream_urls(video)
+        mp3_urls = stream_urls(audio)
+        stream_bytes = expected_bytes(video, duration) + expected_bytes(audio, duration)
+    # if not video_urls:
     #     return None, 701
-    mp3_url = ''
-    if play_info_json and play_info_json.get('data') and play_info_json.get('data').get('dash'):
-        for audio in play_info_json['data']['dash']['audio']:
-            if '40.2' in audio['codecs'] or video['id'] == 30280:
-                mp3_url = audio['base_url']
-                break
     note_id = ''
     kol_id = ''
     kol_name = ''
@@ -163,85 +506,86 @@ def build_video_json(response):
                'note_id': note_id,
                'kol_id': kol_id,
                'kol_name': kol_name,
-               'video_url': video_url,
-               'mp3_url': mp3_url,
+               'video_url': video_urls[0] if video_urls else '',
+               'mp3_url': mp3_urls[0] if mp3_urls else '',
+               # 主地址失败时依次尝试的备用镜像
+               'video_backup_urls': video_urls[1:],
+               'mp3_backup_urls': mp3_urls[1:],
+               # 按码率估算的音视频总字节数
+               'expected_bytes': stream_bytes,
                'img_url_list': img_url_list,
-               'post_date': post_date
+               'post_date': post_date,
+               'duration': duration
            }, 200
 
 
-def download_mp4(mp4_url, mp3_url, note_id, referer, cookie):
-    headers = {
+def build_cached_video_json():
+    """
+    不联网，逐个解析页面缓存里的所有页面，返回(链接, build_json, status)
+    """
+    for url, response in page_cache().items():
+        build_json, status = build_video_json(response)
+        yield url, build_json, status
+
+
+def stream_headers(referer, cookie):
+    return {
         'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-        'accept-language': 'zh-CN,zh;q=0.9,en-US;q=0.8,en;q=0.7',
         'Referer': referer,
         'cookie': cookie,
         'priority': 'u=0, i',
-        'sec-ch-ua': '"Not)A;Brand";v="99", "Google Chrome";v="127", "Chromium";v="127"',
-        'sec-ch-ua-mobile': '?0',
-        'sec-ch-ua-platform': '"Windows"',
         'sec-fetch-dest': 'document',
         'sec-fetch-mode': 'navigate',
         'sec-fetch-site': 'same-origin',
         'sec-fetch-user': '?1',
         'upgrade-insecure-requests': '1',
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36',
     }
-    i = 0
-    while True:
-        if i == 3:
-            return '下载失败'
-        i = i + 1
-        try:
-            session = requests.session()
-            session.mount('http://', HTTPAdapter(max_retries=3))
-            session.mount('https://', HTTPAdapter(max_retries=3))
-            mp3_response = session.get(
-                mp3_url,
-                headers=headers,
-            )
-            mp4_response = session.get(
-                mp4_url,
-                headers=headers,
-            )
-            if len(mp3_response.content) < 10 or len(mp4_response.content) < 10 or \
-                mp3_response.text.replace(' ', '').find('429TooManyRequests') > 0 or mp4_response.text.replace(' ', '')\
-                    .find('429 Too Many Requests') > 0 or mp3_response.status_code == 429 or mp4_response.status_code == 429:
-                time.sleep(5)
-                continue
-            mp3_file_path = download(mp3_response, os.path.join('bilibili_static', get_yyyymmdd()),
-                                          f'{str(uuid.uuid4())}.mp3')
-            mp4_file_path = download(mp4_response, os.path.join('bilibili_static', get_yyyymmdd()),
-                                          f'{str(uuid.uuid4())}.mp4')
-            print("哔哩哔哩的视频和音频下载成功开始合并！")
-            # 加载视频和音频文件
-            video = VideoFileClip(mp4_file_path)
-            audio = AudioFileClip(mp3_file_path)
-            # 将音频合并到视频中
-            final_video = video.set_audio(audio)
-            # 保存输出文件
-            file_path = os.path.join('bilibili_static', get_yyyymmdd(), f'{note_id}.mp4')
-            final_video.write_videofile(os.path.join('bilibili_static', get_yyyymmdd(), f'{note_id}.mp4'),
-                                        codec="libx264", audio_codec="aac")
-            print("合并完删除临时创建的MP3和MP4！")
-            # os.remove(mp4_file_path)
-            # os.remove(mp3_file_path)
-            return file_path
-        except Exception as e:
-            print(f'哔哩哔哩下载资源失败', e)
-        finally:
-            session.close()
-        time.sleep(5)
-        continue
+
+
+def download_mp4(mp4_url, mp3_url, note_id, referer, cookie, mp4_backup_urls=(), mp3_backup_urls=(),
+                 fallback_reencode=False):
+    """
+    :param fallback_reencode: 直接复制音视频流失败时是否用moviepy重新编码（很慢）
+    """
+    headers = stream_headers(referer, cookie)
+    base_dir = os.path.join('bilibili_static', get_yyyymmdd())
+    # 音频和视频共用会话池，同时下载，各自独立重试
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        mp3_future = executor.submit(download_stream_with_retry, SESSION_POOL, mp3_url, headers, base_dir,
+                                     f'{note_id}_temp.mp3', backup_urls=mp3_backup_urls)
+        mp4_future = executor.submit(download_stream_with_retry, SESSION_POOL, mp4_url, headers, base_dir,
+                                     f'{note_id}_temp.mp4', backup_urls=mp4_backup_urls)
+        mp3_file_path = mp3_future.result()
+        mp4_file_path = mp4_future.result()
+    if not mp3_file_path or not mp4_file_path:
+        return '下载失败'
+    try:
+        print("哔哩哔哩的视频和音频下载成功开始合并！")
+        file_path = os.path.join(base_dir, f'{note_id}.mp4')
+        with MUX_SEMAPHORE:
+            merge_video_audio(mp4_file_path, mp3_file_path, file_path, fallback_reencode)
+        print("合并完删除临时创建的MP3和MP4！")
+        # os.remove(mp4_file_path)
+        # os.remove(mp3_file_path)
+        return file_path
+    except Exception as e:
+        print(f'哔哩哔哩合并音视频失败', e)
+        return '下载失败'
+
+
+def download_audio(mp3_url, note_id, referer, cookie, backup_urls=()):
+    """
+    只下载音频流，不需要合并，直接保存成{note_id}.m4a
+    """
+    file_path = download_stream_with_retry(SESSION_POOL, mp3_url, stream_headers(referer, cookie),
+                                           os.path.join('bilibili_static', get_yyyymmdd()), f'{note_id}.m4a',
+                                           backup_urls=backup_urls)
+    return file_path or '下载失败'
 
 
 def download_img(url, note_id, referer):
     headers = {
         'Referer': referer,
-        'sec-ch-ua': '"Not)A;Brand";v="99", "Google Chrome";v="127", "Chromium";v="127"',
-        'sec-ch-ua-mobile': '?0',
-        'sec-ch-ua-platform': '"Windows"',
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36',
     }
     i = 0
     while True:
@@ -249,29 +593,44 @@ def download_img(url, note_id, referer):
             return '下载失败'
         i = i + 1
         try:
-            session = requests.session()
-            session.mount('http://', HTTPAdapter(max_retries=3))
-            session.mount('https://', HTTPAdapter(max_retries=3))
-            response = session.get(
-                url,
-                headers=headers,
-            )
-            if len(response.content) < 10 or response.text.replace(' ', '').find('429TooManyRequests') > 0 or \
-                    response.status_code == 429:
+            with DOWNLOAD_SEMAPHORE:
+                file_path = download_url(SESSION_POOL, url, headers, os.path.join('bilibili_static', get_yyyymmdd()),
+                                         f'{note_id}.jpg')
+            if not file_path:
                 time.sleep(5)
                 continue
-            file_path = download(response, os.path.join('bilibili_static', get_yyyymmdd()), f'{note_id}.jpg')
             return file_path
         except Exception as e:
             print(f'请求失败{url}', e)
-        finally:
-            session.close()
+            if is_throttled(e):
+                continue
         time.sleep(5)
         continue
 
 
-def bilibili_crawl(link, cookies):
-    result_json = {
+def download_imgs(url_list, note_id, referer, workers=IMAGE_WORKERS_PER_POST, positions=None):
+    """
+    同一条动态的图片并发下载，返回的路径顺序与url_list一致，文件名仍为{note_id}_{i}.jpg
+    positions指定每张图片在动态中的序号，默认就是在url_list中的位置
+    某张图片失败只会在对应位置返回'下载失败'，不影响其他图片
+    """
+    if positions is None:
+        positions = range(len(url_list))
+    with ThreadPoolExecutor(max_workers=max(min(workers, len(url_list)), 1)) as executor:
+        futures = [executor.submit(download_img, img_url, note_id + '_' + str(i), referer)
+                   for i, img_url in zip(positions, url_list)]
+        return [future.result() for future in futures]
+
+
+# metadata：只取账号、内容、发布时间和时长，不下载任何资源；audio：只下载音频；full：下载视频（含音频）和图片
+CRAWL_MODES = ('metadata', 'audio', 'full')
+
+
+def empty_result(link):
+    """
+    没有抓到内容时的结果
+    """
+    return {
         'home_link': '',
         'kol_id': '',
         'kol_name': '',
@@ -282,8 +641,74 @@ def bilibili_crawl(link, cookies):
         'image_path_list': [],
         'post_date': ''
     }
-    resp = request_web_home(link, cookies)
-    build_json, status = build_video_json(resp)
+
+
+def media_id(build_json, page_url):
+    """
+    文件名和索引里用的id，多P视频的各个分P共用一个bvid，加上分P序号区分
+    """
+    if video_part(page_url) > 1:
+        return f'{build_json["note_id"]}_p{video_part(page_url)}'
+    return build_json['note_id']
+
+
+def has_missing_media(index, build_json, note_id, mode):
+    """
+    当前模式需要、但索引里还没有的资源
+    """
+    if mode == 'audio':
+        return bool(build_json['mp3_url']) and not index.get_media(note_id, 'audio')
+    if mode == 'full':
+        if build_json['video_url'] and not index.get_media(note_id, 'video'):
+            return True
+        return any(not index.get_media(note_id, 'image', i) for i in range(len(build_json['img_url_list'])))
+    return False
+
+
+def bilibili_crawl(link, cookies, mode='full', reuse_result=False, offline=False, fallback_reencode=False,
+                   video_policy=None, audio_policy=None):
+    """
+    每次都会请求页面取最新的账号、内容等信息，索引里已经下载好的视频、音频、图片不再下载
+    :param mode: 抓取模式，见CRAWL_MODES；audio模式下音频路径放在结果的audio_url里
+    :param reuse_result: full模式下为True时，如果索引里有该链接上次完整抓取的结果且文件都完好，直接返回，不请求页面
+    :param offline: 为True时只用页面缓存，不发任何请求，只能和metadata模式一起用
+    :param fallback_reencode: 合并音视频时直接复制流失败，是否改为重新编码
+    :param video_policy: 视频流的选择策略（StreamPolicy），None时用bilibili_stream_selector.VIDEO_POLICY
+    :param audio_policy: 音频流的选择策略（StreamPolicy），None时用bilibili_stream_selector.AUDIO_POLICY
+    """
+    if mode not in CRAWL_MODES:
+        raise ValueError(f'不支持的抓取模式：{mode}')
+    if offline and mode != 'metadata':
+        raise ValueError('离线模式不能下载资源，只能使用metadata模式')
+    index = media_index()
+    # 索引里只有full模式的结果；metadata模式用来刷新信息，总是请求页面
+    if reuse_result and mode == 'full':
+        cached = index.get_post(link)
+        if cached:
+            print(f'{link}已经抓取过，使用本地索引中的结果')
+            return cached
+    result_json = empty_result(link)
+    # 短链先解析成标准链接再请求页面，省掉每次的跳转
+    page_url = short_link_resolver().resolve(link, offline=offline) if is_short_link(link) else link
+    resp = request_web_home(page_url, cookies, offline=offline)
+    if resp is None:
+        if offline:
+            print(f'{link}没有页面缓存')
+            return result_json
+        # 多次被限流或请求失败，重新排队
+        print(f'请求页面失败bilibili {link}重新塞回队列')
+        result_json['reverse'] = 1
+        return result_json
+    build_json, status = build_video_json(resp, video_policy, audio_policy)
+    if status == 200 and getattr(resp, 'from_cache', False) and \
+            has_missing_media(index, build_json, media_id(build_json, page_url), mode):
+        # 缓存页面里的音视频地址可能已经过期，要下载资源时重新请求页面
+        resp = request_web_home(page_url, cookies, fresh=True)
+        if resp is None:
+            print(f'请求页面失败bilibili {link}重新塞回队列')
+            result_json['reverse'] = 1
+            return result_json
+        build_json, status = build_video_json(resp, video_policy, audio_policy)
     if status == 404:
         # 打不开页面
         print(f'{link}打不开页面')
@@ -296,23 +721,58 @@ def bilibili_crawl(link, cookies):
         mate_url = f'https://www.bilibili.com/video/{build_json["note_id"]}'
         if build_json["note_id"].startswith('cv'):
             mate_url = f'https://www.bilibili.com/read/{build_json["note_id"]}'
-        format = ''
-        if build_json['video_url'] != '':
-            # 下载视频
-            result_json['video_url'] = download_mp4(build_json['video_url'], build_json['mp3_url'], build_json['note_id']
-                                                    , mate_url, cookies)
-            if result_json['video_url'] == '下载失败':
-                print(f'下载失败bilibili {link}重新塞回队列')
-                result_json['reverse'] = 1
-                return result_json
-            else:
-                format = get_video_duration(result_json['video_url'])
+        note_id = media_id(build_json, page_url)
+        # 时长优先用playinfo里的，metadata模式不下载任何资源
+        format = build_json['duration']
         image_path_list = []
-        if build_json['img_url_list'] and len(build_json['img_url_list']) > 0:
-            for i, img_url in enumerate(build_json['img_url_list']):
-                url_path = download_img(img_url, build_json['note_id'] + '_' + str(i),
-                                                 mate_url)
-                image_path_list.append(url_path)
+        with note_lock(note_id):
+            if mode == 'audio' and build_json['mp3_url'] != '':
+                indexed = index.get_media(note_id, 'audio')
+                if indexed:
+                    result_json['audio_url'], format = indexed
+                    format = format or ''
+                else:
+                    result_json['audio_url'] = download_audio(build_json['mp3_url'], note_id, mate_url, cookies,
+                                                              build_json['mp3_backup_urls'])
+                    if result_json['audio_url'] == '下载失败':
+                        print(f'下载失败bilibili {link}重新塞回队列')
+                        result_json['reverse'] = 1
+                        return result_json
+                    format = format or get_video_duration(result_json['audio_url'])
+                    index.add_media(note_id, 'audio', link, result_json['audio_url'], duration=format)
+            if mode == 'full' and build_json['video_url'] != '':
+                indexed = index.get_media(note_id, 'video')
+                if indexed:
+                    # 之前已经下载合并好
+                    result_json['video_url'], format = indexed
+                    format = format or ''
+                else:
+                    # 下载视频
+                    if build_json['expected_bytes']:
+                        print(f'{note_id}预计下载{build_json["expected_bytes"] / 1024 / 1024:.1f}MB')
+                    result_json['video_url'] = download_mp4(build_json['video_url'], build_json['mp3_url'], note_id
+                                                            , mate_url, cookies, build_json['video_backup_urls'],
+                                                            build_json['mp3_backup_urls'], fallback_reencode)
+                    if result_json['video_url'] == '下载失败':
+                        print(f'下载失败bilibili {link}重新塞回队列')
+                        result_json['reverse'] = 1
+                        return result_json
+                    else:
+                        format = build_json['duration'] or get_video_duration(result_json['video_url'])
+                        index.add_media(note_id, 'video', link, result_json['video_url'], duration=format)
+            if mode == 'full' and build_json['img_url_list'] and len(build_json['img_url_list']) > 0:
+                # 只下载索引里没有的图片
+                for i in range(len(build_json['img_url_list'])):
+                    indexed = index.get_media(note_id, 'image', i)
+                    image_path_list.append(indexed[0] if indexed else None)
+                missing = [i for i, path in enumerate(image_path_list) if path is None]
+                if missing:
+                    paths = download_imgs([build_json['img_url_list'][i] for i in missing], note_id, mate_url,
+                                          positions=missing)
+                    for i, path in zip(missing, paths):
+                        image_path_list[i] = path
+                        if path != '下载失败':
+                            index.add_media(note_id, 'image', link, path, position=i)
         result_json['format'] = format
         result_json['image_path_list'] = image_path_list
         result_json['home_link'] = build_json['home_link']
@@ -321,10 +781,24 @@ def bilibili_crawl(link, cookies):
         result_json['content'] = build_json['content']
         result_json['post_date'] = build_json['post_date']
         result_json['post_link_is_access'] = 1
+        if mode == 'full' and '下载失败' not in image_path_list:
+            index.add_post(link, note_id, result_json)
         print(result_json)
         return result_json
 
 
+def repair_media_index(cookies, check_hash=False):
+    """
+    检查索引中的文件，只重新抓取有文件缺失或被截断的链接；音频用audio模式重新抓取，视频和图片用full模式
+    """
+    jobs = []
+    for link, kind in media_index().broken_media(check_hash):
+        job = (link, 'audio' if kind == 'audio' else 'full')
+        if job not in jobs:
+            jobs.append(job)
+    return [bilibili_crawl(link, cookies, mode=mode) for link, mode in jobs]
+
+
 if __name__ == '__main__':
     link = 'https://b23.tv/w6VFlrl'
     cookies = ''
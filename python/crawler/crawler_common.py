@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class LatencyWindow:
+    """
+    最近window次调用的耗时（秒），可以在多个线程里同时记录
+    """
+
+    def __init__(self, window=10000):
+        self._costs = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, cost):
+        with self._lock:
+            self._costs.append(cost)
+
+    def summary(self, count_key='requests'):
+        """
+        耗时统计，单位毫秒；count_key是次数字段的名字
+        """
+        with self._lock:
+            costs = sorted(self._costs)
+        if not costs:
+            return {count_key: 0}
+        return {
+            count_key: len(costs),
+            'avg_ms': sum(costs) / len(costs) * 1000,
+            'p50_ms': costs[len(costs) // 2] * 1000,
+            'p95_ms': costs[min(len(costs) - 1, int(len(costs) * 0.95))] * 1000,
+            'max_ms': costs[-1] * 1000,
+        }
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    """
+    不打印访问日志的请求处理类，本地桩服务的Handler继承它
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    """
+    在后台线程里运行的本地桩服务，用with启动和关闭
+    """
+
+    def __init__(self, handler_class, path='', host='127.0.0.1', port=0):
+        self.server = ThreadingHTTPServer((host, port), handler_class)
+        self.url = f'http://{host}:{self.server.server_address[1]}{path}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SqliteStore:
+    """
+    多线程共用一个连接的SQLite存储，schema是建表语句，目录不存在时自动创建
+    """
+
+    def __init__(self, db_path, schema):
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript(schema)
+        self.conn.commit()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            self.conn.execute(sql, params)
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -1,6 +1,9 @@
-import execjs
+import hashlib
+import os
 import random
 import string
+import threading
+import time
 
 
 def generate_noncestr(length=8, mode="alphabet"):
@@ -21,8 +24,91 @@ def generate_noncestr(length=8, mode="alphabet"):
     return result
 
 
-def generate_sign(args):
-    js_code = """
+class NoncePool:
+    """
+    随机字符串池
+    一次取一批随机字节，用查表的方式整批映射成字符，再切成定长的noncestr；
+    最近发出的值用两个轮换的集合记录，保证至少最近window个值不会重复发出
+    """
+
+    def __init__(self, length=8, mode="alphabet", batch_size=4096, window=100000):
+        if mode == "number":
+            charset = string.digits
+        else:
+            charset = string.ascii_letters  # 默认使用字母
+        size = len(charset)
+        self.length = length
+        self.mode = mode
+        self.batch_size = batch_size
+        self.window = window
+        self.collisions = 0
+
+        if window * 2 >= size ** length:
+            # 记录的值占满整个取值空间后将取不到新值
+            raise ValueError(f"window={window} 对长度为{length}的{mode}随机串过大")
+
+        # 只接受小于limit的字节，limit是字符集长度的整数倍，避免取模带来的分布偏差
+        limit = 256 - 256 % size
+        self._table = bytes(ord(charset[b % size]) if b < limit else 0 for b in range(256))
+        self._rejected = bytes(range(limit, 256))
+        self._draw_size = self.batch_size * self.length * 256 // limit + 64
+
+        self._buffer = []
+        self._recent = set()
+        self._previous = set()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        need = self.batch_size * self.length
+        chars = os.urandom(self._draw_size).translate(self._table, self._rejected)
+        while len(chars) < need:
+            chars += os.urandom(self._draw_size).translate(self._table, self._rejected)
+        text = chars[:need].decode("ascii")
+        self._buffer = [text[i:i + self.length] for i in range(0, need, self.length)]
+
+    def get(self):
+        """
+        取一个最近未发出过的noncestr
+        """
+        with self._lock:
+            while True:
+                if not self._buffer:
+                    self._refill()
+                nonce = self._buffer.pop()
+                if nonce in self._recent or nonce in self._previous:
+                    self.collisions += 1
+                    continue
+                if len(self._recent) >= self.window:
+                    self._previous = self._recent
+                    self._recent = set()
+                self._recent.add(nonce)
+                return nonce
+
+    def get_many(self, count):
+        return [self.get() for _ in range(count)]
+
+
+def benchmark_noncestr(count=100000, length=8, mode="alphabet"):
+    """
+    对比generate_noncestr和NoncePool生成count个noncestr的耗时
+    """
+    start = time.perf_counter()
+    for _ in range(count):
+        generate_noncestr(length, mode)
+    old_cost = time.perf_counter() - start
+
+    pool = NoncePool(length, mode)
+    start = time.perf_counter()
+    for _ in range(count):
+        pool.get()
+    new_cost = time.perf_counter() - start
+
+    print(f"generate_noncestr: {old_cost:.3f}s, NoncePool: {new_cost:.3f}s, "
+          f"提速 {old_cost / new_cost:.1f}x, 跳过重复 {pool.collisions} 次")
+    return old_cost, new_cost
+
+
+SIGN_JS_CODE = """
 function stringToBytes(t) {
     t = unescape(encodeURIComponent(t))
     for (var e = [], n = 0; n < t.length; n++)
@@ -85,11 +171,108 @@ function a(t) {
     }
     return bytesToHex(wordsToBytes([a, c, s, f, l]))
 }
+"""
+
+# 签名等价性校验语料：ASCII、中文、emoji 以及分页参数串
+SIGN_SAMPLES = [
+    "",
+    "a",
+    "abc",
+    "&cursor=AoJ4v/u475kDKDUyMjEyMjI1&noncestr=92434312&pageSize=10&source=1&timestamp=1760410562410",
+    "cursor=AoJ4v/u475kDKDUyMjEyMjI1&noncestr=92434312&pageSize=10&source=1&timestamp=1760410562410",
+    "The quick brown fox jumps over the lazy dog",
+    "x" * 55,
+    "x" * 56,
+    "x" * 64,
+    "y" * 1000,
+    "丁香园",
+    "丁香医生：科普内容&source=1",
+    "éàü ñ ß",
+    "😀",
+    "👨‍👩‍👧‍👦 family",
+    "混合 mixed 🚀 内容 &pageSize=10",
+    "𠀀𠀁𠀂",
+    "\n\r\t\x00",
+]
+
+
+def js_string(value):
+    """
+    按JS的String()规则转成字符串：None为null，布尔为true/false，整数值的float不带小数点；
+    其他类型（包括非整数的float）JS和Python的写法不一致，直接报错
     """
-    ctx = execjs.compile(js_code)
+    if isinstance(value, str):
+        return value
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e21:
+        return str(int(value))
+    raise TypeError(f'不支持的签名参数类型：{type(value).__name__} {value!r}')
+
+
+def generate_sign(args):
+    """
+    生成请求签名，与JS中的a()函数逐位一致
+    JS先做unescape(encodeURIComponent(t))得到UTF-8字节，再做标准SHA-1，这里直接用hashlib计算
+    """
+    args = js_string(args)
+    return hashlib.sha1(args.encode('utf-8')).hexdigest()
+
+
+def generate_sign_js(args):
+    """
+    用原始JS代码生成签名，仅作为校验generate_sign的对照
+    """
+    import execjs
+    ctx = execjs.compile(SIGN_JS_CODE)
     return ctx.call("a", args)
 
 
+class SignedParamsBuilder:
+    """
+    dxy请求签名：参数按key排序拼成 k=v&k=v 后做SHA-1
+    """
+
+    @staticmethod
+    def canonicalize(params):
+        """
+        生成参与签名的参数串
+        """
+        return "&".join(k + "=" + js_string(params[k]) for k in sorted(params))
+
+    def sign(self, params):
+        return generate_sign(self.canonicalize(params))
+
+    def sign_many(self, params_list):
+        """
+        批量签名
+        :param params_list: 参数字典列表，例如一条游标链上的每一页
+        :return: 与params_list一一对应的签名列表
+        """
+        return [generate_sign(self.canonicalize(params)) for params in params_list]
+
+
+def verify_sign(samples=None):
+    """
+    逐条对比Python签名和JS签名，返回不一致的样本列表
+    """
+    if samples is None:
+        samples = SIGN_SAMPLES
+    import execjs
+    ctx = execjs.compile(SIGN_JS_CODE)
+    mismatches = []
+    for sample in samples:
+        expected = ctx.call("a", sample)
+        actual = generate_sign(sample)
+        if expected != actual:
+            mismatches.append((sample, expected, actual))
+    return mismatches
+
+
 if __name__ == '__main__':
     params = {
         "cursor": "AoJ4v/u475kDKDUyMjEyMjI1",
@@ -98,11 +281,15 @@ if __name__ == '__main__':
         "source": "1",
         "timestamp": 1760410562410,
     }
-    content = ''
-    for k, v in params.items():
-        content += "&" + k + "=" + str(v)
-    content.rstrip("&")
+    builder = SignedParamsBuilder()
+    content = builder.canonicalize(params)
     print(content)
-    sign = generate_sign(content)
+    sign = builder.sign(params)
     print(sign)
-
+    # 游标链批量签名
+    pages = [dict(params, cursor=params["cursor"] + str(i)) for i in range(3)]
+    print(builder.sign_many(pages))
+    benchmark_noncestr()
+    benchmark_noncestr(mode="number")
+    # 校验Python签名与JS签名一致
+    print('签名不一致的样本：', verify_sign())
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from crawler_common import QuietHandler, StubServer
+from dxy_crawler import NoncePool, SignedParamsBuilder
+
+
+def parse_feed_page(data):
+    """
+    默认的分页解析：返回(本页数据, 下一页游标)，没有下一页时游标为None
+    """
+    body = data.get("data") or {}
+    items = body.get("items") or body.get("list") or []
+    cursor = body.get("cursor") or body.get("nextCursor")
+    if body.get("hasMore") is False:
+        cursor = None
+    return items, cursor
+
+
+class RateLimiter:
+    """
+    异步限速，保证两次请求的间隔不小于1/rate秒
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next_time = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self._next_time > now:
+                await asyncio.sleep(self._next_time - now)
+                now = self._next_time
+            self._next_time = now + self.interval
+
+
+class JsonlSink:
+    """
+    把数据逐行写入jsonl文件，可以在多个线程里同时调用write
+    """
+
+    def __init__(self, file_path):
+        self.file = open(file_path, "a", encoding="utf-8")
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def write(self, items):
+        lines = "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items)
+        with self._lock:
+            self.file.write(lines)
+            self.file.flush()
+            self.count += len(items)
+
+    def close(self):
+        self.file.close()
+
+
+class DxyFeedCrawler:
+    """
+    丁香园信息流游标翻页爬虫
+    拿到第N页后先取出下一页游标，立刻签名并请求第N+1页，同时解析、写出第N页的数据
+    """
+
+    def __init__(self, feed_url, page_size=10, source=1, concurrency=4, rate=5.0, headers=None,
+                 parse_page=parse_feed_page, max_pages=None, timeout=10):
+        self.feed_url = feed_url
+        self.page_size = page_size
+        self.source = source
+        self.headers = headers or {}
+        self.parse_page = parse_page
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.session = requests.session()
+        self.builder = SignedParamsBuilder()
+        self.nonce_pool = NoncePool()
+        self.concurrency = concurrency
+        self.rate = rate
+        self._semaphore = None
+        self._limiter = None
+
+    def build_params(self, cursor):
+        params = {
+            "cursor": cursor,
+            "noncestr": self.nonce_pool.get(),
+            "pageSize": self.page_size,
+            "source": self.source,
+            "timestamp": int(time.time() * 1000),
+        }
+        params["sign"] = self.builder.sign(params)
+        return params
+
+    async def fetch_page(self, cursor):
+        async with self._semaphore:
+            i = 0
+            while True:
+                i = i + 1
+                await self._limiter.acquire()
+                try:
+                    response = await asyncio.to_thread(self.session.get, self.feed_url,
+                                                       params=self.build_params(cursor),
+                                                       headers=self.headers, timeout=self.timeout)
+                    response.raise_for_status()
+                    return response.json()
+                except Exception as e:
+                    if i == 3:
+                        raise
+                    print(f'请求失败，开始重试 cursor={cursor}', e)
+                    await asyncio.sleep(1)
+
+    async def crawl(self, sink, cursor=""):
+        """
+        沿游标链翻页，返回抓取的页数
+        """
+        pages = 0
+        next_page = asyncio.create_task(self.fetch_page(cursor))
+        while next_page:
+            data = await next_page
+            pages += 1
+            items, next_cursor = self.parse_page(data)
+            next_page = None
+            if next_cursor and (self.max_pages is None or pages < self.max_pages):
+                next_page = asyncio.create_task(self.fetch_page(next_cursor))
+            # 写出放到线程里，等待写出时事件循环去签名、请求下一页
+            await asyncio.to_thread(sink.write, items)
+        return pages
+
+    async def crawl_many(self, sink, cursors=("",)):
+        """
+        同时抓取多条游标链，并发数和限速由concurrency、rate控制
+        """
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._limiter = RateLimiter(self.rate)
+        try:
+            return await asyncio.gather(*(self.crawl(sink, cursor) for cursor in cursors))
+        finally:
+            self.session.close()
+
+    def run(self, sink_path, cursors=("",)):
+        sink = JsonlSink(sink_path)
+        try:
+            return asyncio.run(self.crawl_many(sink, cursors))
+        finally:
+            sink.close()
+
+
+class RecordedFeedServer(StubServer):
+    """
+    本地桩服务：按请求中的cursor返回录制好的分页数据
+    pages: {cursor: 响应json}
+    """
+
+    def __init__(self, pages, host="127.0.0.1", port=0):
+        recorded = pages
+
+        class Handler(QuietHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query, keep_blank_values=True)
+                cursor = query.get("cursor", [""])[0]
+                if cursor not in recorded or "sign" not in query:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = json.dumps(recorded[cursor], ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        super().__init__(Handler, path="/feed", host=host, port=port)
+
+    @staticmethod
+    def load(file_path):
+        """
+        从jsonl文件加载录制的分页，每行 {"cursor": ..., "response": ...}
+        """
+        pages = {}
+        with open(file_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    pages[record["cursor"]] = record["response"]
+        return pages
+
+
+if __name__ == '__main__':
+    # 用录制的游标链在本地桩服务上跑一遍
+    recorded_pages = {}
+    cursor = ""
+    for page in range(20):
+        next_cursor = f"cursor{page + 1}" if page < 19 else None
+        recorded_pages[cursor] = {
+            "code": "success",
+            "data": {
+                "items": [{"id": page * 10 + i, "title": f"第{page}页第{i}条"} for i in range(10)],
+                "cursor": next_cursor,
+                "hasMore": next_cursor is not None,
+            },
+        }
+        cursor = next_cursor
+    with RecordedFeedServer(recorded_pages) as server:
+        crawler = DxyFeedCrawler(server.url, rate=50)
+        start = time.perf_counter()
+        print('抓取页数：', crawler.run('dxy_feed.jsonl'))
+        print(f'耗时：{time.perf_counter() - start:.3f}s')
@@ -0,0 +1,193 @@
+import atexit
+import hashlib
+import json
+import os
+import queue
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from crawler_common import LatencyWindow
+
+# 常驻node进程：逐行读取JSON指令，脚本按key只编译一次，之后直接调用其中的函数
+NODE_WORKER_JS = r"""
+const vm = require('vm');
+const readline = require('readline');
+const contexts = {};
+const rl = readline.createInterface({input: process.stdin});
+rl.on('line', (line) => {
+    let reply;
+    try {
+        const msg = JSON.parse(line);
+        if (msg.op === 'load') {
+            if (!(msg.key in contexts)) {
+                const ctx = vm.createContext({});
+                vm.runInContext(msg.source, ctx);
+                contexts[msg.key] = ctx;
+            }
+            reply = {ok: true};
+        } else {
+            const ctx = contexts[msg.key];
+            reply = {ok: true, result: ctx[msg.name].apply(null, msg.args)};
+        }
+    } catch (e) {
+        reply = {ok: false, error: String(e)};
+    }
+    process.stdout.write(JSON.stringify(reply) + '\n');
+});
+"""
+
+
+class JsSignError(Exception):
+    pass
+
+
+class JsWorker:
+    """
+    一个常驻的node进程
+    """
+
+    def __init__(self, node_path="node"):
+        self.process = subprocess.Popen(
+            [node_path, "-e", NODE_WORKER_JS],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+        )
+        self.loaded = set()
+
+    def request(self, msg):
+        try:
+            self.process.stdin.write(json.dumps(msg) + "\n")
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        except (BrokenPipeError, OSError) as e:
+            raise JsSignError(f"node进程已退出：{e}")
+        if not line:
+            raise JsSignError("node进程已退出")
+        reply = json.loads(line)
+        if not reply["ok"]:
+            raise JsSignError(reply["error"])
+        return reply.get("result")
+
+    def call(self, key, source, name, args):
+        if key not in self.loaded:
+            self.request({"op": "load", "key": key, "source": source})
+            self.loaded.add(key)
+        return self.request({"op": "call", "key": key, "name": name, "args": list(args)})
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        if self.alive():
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class JsScript:
+    """
+    JsSignPool.compile的返回值，用法同execjs：ctx.call("a", args)
+    """
+
+    def __init__(self, pool, key, source):
+        self.pool = pool
+        self.key = key
+        self.source = source
+
+    def call(self, name, *args):
+        return self.pool.call(self.key, name, *args)
+
+    def map(self, name, args_list):
+        """
+        并行调用，args_list中每项是一次调用的参数
+        """
+        return self.pool.map(self.key, name, args_list)
+
+
+class JsSignPool:
+    """
+    JS签名服务
+    脚本按源码的sha256缓存，每个node进程只编译一次；调用分发到多个常驻node进程上并行执行，
+    并记录每次调用的耗时，方便判断哪些签名函数值得改写成Python
+    """
+
+    def __init__(self, size=None, node_path="node", latency_window=10000):
+        self.size = size or os.cpu_count() or 1
+        self.node_path = node_path
+        self.latency_window = latency_window
+        self._sources = {}
+        self._scripts = {}
+        self._latency = {}
+        self._lock = threading.Lock()
+        self._idle = queue.Queue()
+        for _ in range(self.size):
+            self._idle.put(JsWorker(node_path))
+        self._executor = ThreadPoolExecutor(max_workers=self.size)
+        atexit.register(self.close)
+
+    def compile(self, source):
+        script = self._scripts.get(source)
+        if script is None:
+            key = hashlib.sha256(source.encode("utf-8")).hexdigest()
+            with self._lock:
+                self._sources[key] = source
+                self._latency.setdefault(key, LatencyWindow(self.latency_window))
+                script = self._scripts.setdefault(source, JsScript(self, key, source))
+        return script
+
+    def call(self, key, name, *args):
+        source = self._sources[key]
+        worker = self._idle.get()
+        start = time.perf_counter()
+        try:
+            return worker.call(key, source, name, args)
+        finally:
+            cost = time.perf_counter() - start
+            self._latency[key].add(cost)
+            if not worker.alive():
+                # 进程挂掉就换一个新的，已编译的脚本会在下次调用时重新加载
+                worker = JsWorker(self.node_path)
+            self._idle.put(worker)
+
+    def map(self, key, name, args_list):
+        return list(self._executor.map(lambda args: self.call(key, name, *args), args_list))
+
+    def stats(self):
+        """
+        每个脚本的调用耗时统计，单位毫秒
+        """
+        with self._lock:
+            latency = dict(self._latency)
+        result = {key: window.summary("calls") for key, window in latency.items()}
+        return {key: summary for key, summary in result.items() if summary["calls"]}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+if __name__ == "__main__":
+    from dxy_crawler import SIGN_JS_CODE, generate_sign
+
+    pool = JsSignPool()
+    ctx = pool.compile(SIGN_JS_CODE)
+    content = "cursor=AoJ4v/u475kDKDUyMjEyMjI1&noncestr=92434312&pageSize=10&source=1&timestamp=1760410562410"
+    print(ctx.call("a", content), generate_sign(content))
+
+    pages = [(content + str(i),) for i in range(2000)]
+    start = time.perf_counter()
+    signs = ctx.map("a", pages)
+    print(f"JS进程池签名{len(pages)}次耗时：{time.perf_counter() - start:.3f}s")
+    start = time.perf_counter()
+    native = [generate_sign(args[0]) for args in pages]
+    print(f"Python签名{len(pages)}次耗时：{time.perf_counter() - start:.3f}s，结果一致：{signs == native}")
+    for key, stat in pool.stats().items():
+        print(key[:12], stat)
+    pool.close()
@@ -0,0 +1,147 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from crawler_common import LatencyWindow, QuietHandler, StubServer
+from mcc_red_crawler import header_xs, header_xs_body, header_xs_common
+
+
+def default_page_items(data):
+    """
+    默认从分页响应中取列表数据
+    """
+    body = data.get('data') or {}
+    return body.get('list') or body.get('records') or []
+
+
+class MccClient:
+    """
+    MCC接口客户端
+    整个客户端共用一个长连接池；x-t、x-s、x-s-common在发送时才生成，报文只序列化一次
+    """
+
+    def __init__(self, base_url, headers=None, cookies=None, pool_size=10, workers=4, timeout=10,
+                 latency_window=10000):
+        self.base_url = base_url.rstrip('/')
+        self.workers = workers
+        self.timeout = timeout
+        self.session = requests.session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=3)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'accept': 'application/json, text/plain, */*',
+            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36',
+        })
+        if headers:
+            self.session.headers.update(headers)
+        if cookies:
+            self.session.cookies.update(cookies)
+        self._latency = LatencyWindow(latency_window)
+
+    def request(self, method, path, json_body=None, params=None):
+        x_t = str(int(time.time() * 1000))
+        headers = {'x-t': x_t, 'x-s-common': header_xs_common()}
+        data = None
+        if json_body is not None:
+            headers['x-s'], data = header_xs_body(x_t, 'test', path, json_body)
+            headers['content-type'] = 'application/json;charset=UTF-8'
+        else:
+            headers['x-s'] = header_xs(x_t, 'test', path, False, None)
+        start = time.perf_counter()
+        response = self.session.request(method, self.base_url + path, params=params, data=data,
+                                        headers=headers, timeout=self.timeout)
+        self._latency.add(time.perf_counter() - start)
+        response.raise_for_status()
+        return response.json()
+
+    def get(self, path, params=None):
+        return self.request('GET', path, params=params)
+
+    def post(self, path, json_body):
+        return self.request('POST', path, json_body=json_body)
+
+    def fetch_pages(self, path, body, page_indexes, page_size=20):
+        """
+        并发获取指定页，结果按page_indexes的顺序返回
+        """
+        def fetch(page_index):
+            return self.post(path, dict(body, pageIndex=page_index, pageSize=page_size))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(fetch, page_indexes))
+
+    def fetch_all(self, path, body, page_size=20, get_items=default_page_items, max_pages=None):
+        """
+        每次并发取workers页，直到某一页没有数据，按页序返回所有数据
+        """
+        items = []
+        page_index = 1
+        while max_pages is None or page_index <= max_pages:
+            last = page_index + self.workers
+            if max_pages is not None:
+                last = min(last, max_pages + 1)
+            for data in self.fetch_pages(path, body, range(page_index, last), page_size):
+                page_items = get_items(data)
+                if not page_items:
+                    return items
+                items.extend(page_items)
+            page_index = last
+        return items
+
+    def stats(self):
+        """
+        请求耗时统计，单位毫秒
+        """
+        return self._latency.summary()
+
+    def close(self):
+        self.session.close()
+
+
+class StubMccServer(StubServer):
+    """
+    本地桩服务：校验签名头后按pageIndex返回total条数据的分页
+    """
+
+    def __init__(self, total=1000, delay=0.0, host='127.0.0.1', port=0):
+        class Handler(QuietHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if not (self.headers.get('x-t') and self.headers.get('x-s') and self.headers.get('x-s-common')):
+                    self.send_response(403)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                time.sleep(delay)
+                page_index = body.get('pageIndex', 1)
+                page_size = body.get('pageSize', 20)
+                start = (page_index - 1) * page_size
+                rows = [{'id': i} for i in range(start, min(start + page_size, total))]
+                data = json.dumps({'code': 0, 'data': {'list': rows, 'total': total}}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        super().__init__(Handler, host=host, port=port)
+
+
+if __name__ == '__main__':
+    with StubMccServer(total=2000, delay=0.01) as server:
+        client = MccClient(server.url, workers=8)
+        start = time.perf_counter()
+        rows = client.fetch_all('/api/mcc/apply/list', {'applyDataType': 2}, page_size=20)
+        cost = time.perf_counter() - start
+        print(f'共{len(rows)}条，顺序正确：{[row["id"] for row in rows] == list(range(2000))}，耗时{cost:.3f}s')
+        stats = client.stats()
+        print(f'吞吐：{stats["requests"] / cost:.1f}次/s', stats)
+        client.close()
@@ -1,12 +1,50 @@
 import base64
 import hashlib
+import io
 import json
 import random
+import sys
+import threading
+import time
+from array import array
+
+
+# 自定义Base64字母表，第65个字符"3"是补位标记，输出时会被丢弃
+CUSTOM_BASE64_CHARS = "A4NjFqYu5wPHsO0XTdDgMa2r1ZQocVte9UJBvk6/7=yRnhISGKblCWi+LpfE8xzm3"
+STANDARD_BASE64_CHARS = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+CUSTOM_BASE64_TABLE = bytes.maketrans(STANDARD_BASE64_CHARS, CUSTOM_BASE64_CHARS[:64].encode('ascii'))
+
+
+def js_utf8_encode(s):
+    """
+    模拟JS的utf8编码：按UTF-16码元逐个编码，每个码元最多3字节
+    非BMP字符会拆成两个代理项分别编码（即CESU-8），单独的代理项也按3字节编码
+    """
+    s = s.replace('\r\n', '\n')
+    if s.isascii():
+        return s.encode('ascii')
+    utf16 = s.encode('utf-16-le', 'surrogatepass')
+    if len(utf16) != 2 * len(s):
+        # 有非BMP字符：按UTF-16码元重新拼成字符串，代理项各自成为一个字符，map和chr都在C层执行
+        units = array('H', utf16)
+        if sys.byteorder == 'big':
+            units.byteswap()
+        s = ''.join(map(chr, units))
+    return s.encode('utf-8', 'surrogatepass')
 
 
 def custom_base64_encode(input_str):
     """
-    完全模拟原JS代码的自定义Base64编码函数
+    自定义Base64编码，BMP范围内结果与custom_base64_encode_legacy一致，非BMP字符与JS一致
+    标准Base64去掉"="补位后按预先生成的映射表替换字符，全部在C层完成
+    """
+    data = js_utf8_encode(input_str)
+    return base64.b64encode(data).rstrip(b'=').translate(CUSTOM_BASE64_TABLE).decode('ascii')
+
+
+def custom_base64_encode_legacy(input_str):
+    """
+    完全模拟原JS代码的自定义Base64编码函数，仅用于校验custom_base64_encode
     """
 
     # 第一步：模拟JS中的UTF-8编码函数
@@ -27,7 +65,7 @@ def custom_base64_encode(input_str):
         return bytes(result)
 
     # 第二步：模拟JS中的Base64编码函数
-    base64_chars = "A4NjFqYu5wPHsO0XTdDgMa2r1ZQocVte9UJBvk6/7=yRnhISGKblCWi+LpfE8xzm3"
+    base64_chars = CUSTOM_BASE64_CHARS
 
     # 执行UTF-8编码
     data = utf8_encode(input_str)
@@ -80,12 +118,151 @@ def custom_base64_encode(input_str):
     return ''.join(result)
 
 
+def random_bmp_text(max_length=64):
+    """
+    生成随机的BMP范围字符串（包含ASCII、中文、\r\n和单独的代理项）
+    """
+    ranges = [(0, 127), (128, 2047), (0x4e00, 0x9fff), (0xd800, 0xdfff), (0xe000, 0xffff)]
+    chars = []
+    for _ in range(random.randint(0, max_length)):
+        if random.random() < 0.05:
+            chars.append('\r\n')
+            continue
+        low, high = random.choice(ranges)
+        chars.append(chr(random.randint(low, high)))
+    return ''.join(chars)
+
+
+def verify_js_utf8_encode(count=10000):
+    """
+    用随机语料（含emoji等非BMP字符）对比js_utf8_encode和逐码元编码的结果，返回不一致的样本列表
+    """
+    def encode_by_unit(text):
+        text = text.replace('\r\n', '\n')
+        utf16 = text.encode('utf-16-le', 'surrogatepass')
+        result = []
+        for i in range(0, len(utf16), 2):
+            code = utf16[i] | (utf16[i + 1] << 8)
+            if code < 128:
+                result.append(code)
+            elif code < 2048:
+                result.append((code >> 6) | 192)
+                result.append((code & 63) | 128)
+            else:
+                result.append((code >> 12) | 224)
+                result.append(((code >> 6) & 63) | 128)
+                result.append((code & 63) | 128)
+        return bytes(result)
+
+    mismatches = []
+    for _ in range(count):
+        text = ''.join(random_bmp_text(8) + chr(random.randint(0x10000, 0x10ffff))
+                       for _ in range(random.randint(0, 8)))
+        if js_utf8_encode(text) != encode_by_unit(text):
+            mismatches.append(text)
+    return mismatches
+
+
+def verify_custom_base64(count=10000):
+    """
+    用随机语料对比新旧两个实现，返回不一致的样本列表
+    """
+    mismatches = []
+    for _ in range(count):
+        text = random_bmp_text()
+        if custom_base64_encode(text) != custom_base64_encode_legacy(text):
+            mismatches.append(text)
+    return mismatches
+
+
+def benchmark_custom_base64(count=20000):
+    """
+    对比新旧两个实现的耗时，样本取x-s实际编码的32位md5串
+    """
+    samples = [hashlib.md5(str(i).encode('utf-8')).hexdigest() for i in range(count)]
+    start = time.perf_counter()
+    for text in samples:
+        custom_base64_encode_legacy(text)
+    old_cost = time.perf_counter() - start
+    start = time.perf_counter()
+    for text in samples:
+        custom_base64_encode(text)
+    new_cost = time.perf_counter() - start
+    print(f"custom_base64_encode_legacy: {old_cost:.3f}s, custom_base64_encode: {new_cost:.3f}s, "
+          f"提速 {old_cost / new_cost:.1f}x")
+    return old_cost, new_cost
+
+
+# x-s-common的固定字段，x9在每次生成时替换成随机数
+XS_COMMON_FIELDS = {"s0": 5, "s1": "", "x0": "1", "x1": "4.1.4", "x2": "Windows", "x3": "mcc-shell", "x4": "1.0.17",
+                    "x5": "19897fff3c2se24gfzep1lwgob15g6e8ygzozr0tc50000354746", "x6": "", "x7": "",
+                    "x8": "I38rHdgsjopgIvesdVwgIC+oIELmBZ5e3VwXLgFTIxS3bqwErFeexd0ekncAzMFYnqthIhJed9MDKutRI3KsYorWHPtGrbV0P9WfIi/eWc6eYqtyQApPI37ekmR6QL+5Ii6sdneeSfqYHqwl2qt5B0DBIx+PGDi/sVtkIxdsxuwr4qtiIhuaIE3e3LV0I3VTIC7e0utl2ADmsLveDSKsSPw5IEvsiVtJOqw8BuwfPpdeTFWOIx4TIiu6ZPwrPut5IvlaLbgs3qtxIxes1VwHIkumIkIyejgsY/WTge7eSqte/D7sDcpipedeYrDtIC6eDVw2IENsSqtlnlSuNjVtIvoekqt3cZ7sVo4gIESyIhE4+9DUIvzy4I8OIic7ZPwAIviX4o/sDLds6PwVIC7eSd7e0/k4IEveTZPMtVwUIids3s/sxZNeiVtbcUeeYVwvIvTGa05eSVwCgfosfPwoIxltIxZSouwOgVwpsr4heU/e6LveYPwfICNs1roeTFuMIiNeWL0sxdh5IiJsxPw9IhR9JPwJPutWIv3e1Vt1IiNs1qw5Ih/sYqtSGqwymqwDIvIkICptOjMS4n7sYPtVIiRzIh3sWPwKgIzrcnNsYUmuIihLqutzZPwEIv3eVPtk+pdeTzAsiMmLIiAsx7esTutycPwOIvoeSPwvIiJex0ImICdeS9NeSqt3Ixvs1Pw64B8qIkWyIvgsxFOekgveDS6edVtNIkF1I3Q6JuwCIkZ+I3KeWjSHarNekPwFIxh68qwZBfde1s0s1qtUqutdIkIaICSdoVtK+uwbIx7s0Wde1qwVnPtzIETgoutII3qCb/qcIiesW9OsiFveiqw2+PttIiWJI33sSVtYIEoeDpmTIvkDoWzKIvYrICoejPwLLPt2+qtUI3ruIhJsdA0e1qw9pSqRICG58ut2ZqtNIxhJIxTcIkbQIhNe3F3sVMMiHuwgICI6qVwQBVwTIh0eVMH/Iihvad/edPt7bVtmgWrNBgHVIkZI/VwoIk5s6IYLIkMNnPwhIkTnwqt+HVtKIhVVICk5ICQzZPwUIkZcICvsxPwWZZM7IvZcIvNs09KskVw+IvE7IhWh/crcICROc/MUICKedbvsDutKIhOsfPwtIEltI3veYqteI3RK",
+                    "x9": 0, "x10": 0, "x11": "lite"}
+
+# 自定义字母表
+XS_COMMON_ALPHABET = b"ZmserbBoHQtNP+wOcza/LpngG8yJq42KWYj0DSfdikx3VT16IlUAFM97hECvuRX5"
+XS_COMMON_TABLE = bytes.maketrans(STANDARD_BASE64_CHARS, XS_COMMON_ALPHABET)
+
+
+class XsCommonEncoder:
+    """
+    x-s-common编码器
+    除x9外的字段都是固定的，JSON中x9之前的部分按Base64的3字节边界切开，整组的部分提前编码好，
+    每次只对剩下的零头、x9和后面的短尾巴做Base64
+    """
+
+    def __init__(self, fields=None):
+        self._lock = threading.Lock()
+        self.rotate(fields or XS_COMMON_FIELDS)
+
+    def rotate(self, fields):
+        """
+        替换固定字段（例如更换x8指纹），不需要重启进程
+        """
+        fields = dict(fields)
+        keys = list(fields)
+        index = keys.index("x9")
+
+        def dump_items(items):
+            return ','.join(json.dumps(k, ensure_ascii=False) + ':' +
+                            json.dumps(v, ensure_ascii=False, separators=(',', ':')) for k, v in items)
+
+        items = list(fields.items())
+        head = '{' + dump_items(items[:index]) + (',' if index else '') + '"x9":'
+        tail = (',' if index < len(items) - 1 else '') + dump_items(items[index + 1:]) + '}'
+        head_bytes = head.replace('\r\n', '\n').encode('utf-8')
+        tail_bytes = tail.replace('\r\n', '\n').encode('utf-8')
+        aligned = len(head_bytes) - len(head_bytes) % 3
+        encoded_head = base64.b64encode(head_bytes[:aligned]).translate(XS_COMMON_TABLE).decode('ascii')
+        with self._lock:
+            self.fields = fields
+            self._template = (encoded_head, head_bytes[aligned:], tail_bytes)
+
+    def encode(self, random_number=None):
+        if random_number is None:
+            random_number = random.randint(-500000000, 500000000)
+        encoded_head, rest, tail_bytes = self._template
+        data = rest + str(random_number).encode('ascii') + tail_bytes
+        return encoded_head + base64.b64encode(data).translate(XS_COMMON_TABLE).decode('ascii')
+
+    def encode_many(self, count):
+        return [self.encode() for _ in range(count)]
+
+
+XS_COMMON_ENCODER = XsCommonEncoder()
+
+
 def header_xs_common():
-    random_number = random.randint(-500000000, 500000000)
-    d = {"s0": 5, "s1": "", "x0": "1", "x1": "4.1.4", "x2": "Windows", "x3": "mcc-shell", "x4": "1.0.17",
-                 "x5": "19897fff3c2se24gfzep1lwgob15g6e8ygzozr0tc50000354746", "x6": "", "x7": "",
-                 "x8": "I38rHdgsjopgIvesdVwgIC+oIELmBZ5e3VwXLgFTIxS3bqwErFeexd0ekncAzMFYnqthIhJed9MDKutRI3KsYorWHPtGrbV0P9WfIi/eWc6eYqtyQApPI37ekmR6QL+5Ii6sdneeSfqYHqwl2qt5B0DBIx+PGDi/sVtkIxdsxuwr4qtiIhuaIE3e3LV0I3VTIC7e0utl2ADmsLveDSKsSPw5IEvsiVtJOqw8BuwfPpdeTFWOIx4TIiu6ZPwrPut5IvlaLbgs3qtxIxes1VwHIkumIkIyejgsY/WTge7eSqte/D7sDcpipedeYrDtIC6eDVw2IENsSqtlnlSuNjVtIvoekqt3cZ7sVo4gIESyIhE4+9DUIvzy4I8OIic7ZPwAIviX4o/sDLds6PwVIC7eSd7e0/k4IEveTZPMtVwUIids3s/sxZNeiVtbcUeeYVwvIvTGa05eSVwCgfosfPwoIxltIxZSouwOgVwpsr4heU/e6LveYPwfICNs1roeTFuMIiNeWL0sxdh5IiJsxPw9IhR9JPwJPutWIv3e1Vt1IiNs1qw5Ih/sYqtSGqwymqwDIvIkICptOjMS4n7sYPtVIiRzIh3sWPwKgIzrcnNsYUmuIihLqutzZPwEIv3eVPtk+pdeTzAsiMmLIiAsx7esTutycPwOIvoeSPwvIiJex0ImICdeS9NeSqt3Ixvs1Pw64B8qIkWyIvgsxFOekgveDS6edVtNIkF1I3Q6JuwCIkZ+I3KeWjSHarNekPwFIxh68qwZBfde1s0s1qtUqutdIkIaICSdoVtK+uwbIx7s0Wde1qwVnPtzIETgoutII3qCb/qcIiesW9OsiFveiqw2+PttIiWJI33sSVtYIEoeDpmTIvkDoWzKIvYrICoejPwLLPt2+qtUI3ruIhJsdA0e1qw9pSqRICG58ut2ZqtNIxhJIxTcIkbQIhNe3F3sVMMiHuwgICI6qVwQBVwTIh0eVMH/Iihvad/edPt7bVtmgWrNBgHVIkZI/VwoIk5s6IYLIkMNnPwhIkTnwqt+HVtKIhVVICk5ICQzZPwUIkZcICvsxPwWZZM7IvZcIvNs09KskVw+IvE7IhWh/crcICROc/MUICKedbvsDutKIhOsfPwtIEltI3veYqteI3RK",
-                 "x9": random_number, "x10": 0, "x11": "lite"}
+    return XS_COMMON_ENCODER.encode()
+
+
+def header_xs_common_legacy(random_number=None):
+    """
+    每次完整序列化并编码，仅用于校验XsCommonEncoder
+    """
+    if random_number is None:
+        random_number = random.randint(-500000000, 500000000)
+    d = dict(XS_COMMON_FIELDS, x9=random_number)
 
     # 1. JSON序列化（等效stringify_default）
     json_str = json.dumps(d, ensure_ascii=False, separators=(',', ':'))
@@ -94,19 +271,64 @@ def header_xs_common():
     # 特别注意：处理\r\n转\n（与JS行为一致）
     utf8_bytes = json_str.replace('\r\n', '\n').encode('utf-8')
 
-    # 自定义字母表（示例：将大小写字母互换）
-    custom_alphabet = b"ZmserbBoHQtNP+wOcza/LpngG8yJq42KWYj0DSfdikx3VT16IlUAFM97hECvuRX5"
-
-    # 创建转换表
-    original_alphabet = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
-    translation_table = bytes.maketrans(original_alphabet, custom_alphabet)
-
     # 3. Base64编码（等效b64Encode）
-    base64_str = base64.b64encode(utf8_bytes).translate(translation_table).decode('ascii')
+    base64_str = base64.b64encode(utf8_bytes).translate(XS_COMMON_TABLE).decode('ascii')
 
     return base64_str
 
 
+def benchmark_xs_common(count=20000):
+    """
+    对比每次完整编码和模板编码生成count个x-s-common的耗时
+    """
+    start = time.perf_counter()
+    for _ in range(count):
+        header_xs_common_legacy()
+    old_cost = time.perf_counter() - start
+    start = time.perf_counter()
+    XS_COMMON_ENCODER.encode_many(count)
+    new_cost = time.perf_counter() - start
+    print(f"header_xs_common_legacy: {old_cost:.3f}s, XsCommonEncoder: {new_cost:.3f}s, "
+          f"提速 {old_cost / new_cost:.1f}x")
+    return old_cost, new_cost
+
+
+# 与json.dumps(t, ensure_ascii=False, separators=(',', ':'))输出一致
+BODY_JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def header_xs_body(o, r, e, t, chunk_size=65536):
+    """
+    加密x-s，同时返回要发送的json报文字节
+    报文只序列化一次：iterencode分块编码成UTF-8，边写入缓冲区边更新MD5，不再拼接整段签名字符串
+    :param o: 时间戳，x-t的内容
+    :param r: test死值
+    :param e: 接口url
+    :param t: json报文
+    :param chunk_size: 攒够多少字符更新一次MD5
+    :return: (加密结果, 报文字节)
+    """
+    md5 = hashlib.md5((str(o) + str(r) + str(e)).encode('utf-8'))
+    buffer = io.BytesIO()
+    pending = []
+    pending_size = 0
+    for chunk in BODY_JSON_ENCODER.iterencode(t):
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= chunk_size:
+            data = ''.join(pending).encode('utf-8')
+            md5.update(data)
+            buffer.write(data)
+            pending = []
+            pending_size = 0
+    if pending:
+        data = ''.join(pending).encode('utf-8')
+        md5.update(data)
+        buffer.write(data)
+    # getvalue在缓冲区没有其他引用时直接返回内部bytes，不再复制一份
+    return custom_base64_encode(md5.hexdigest()) + "3", buffer.getvalue()
+
+
 def header_xs(o, r, e, a, t):
     """
     加密x-s
@@ -117,17 +339,9 @@ def header_xs(o, r, e, a, t):
     :param t: json报文
     :return: 加密结果
     """
-
-    # 构建输入字符串
-    parts = [
-        str(o),
-        str(r),
-        str(e),
-        json.dumps(t, ensure_ascii=False, separators=(',', ':')) if a else ""
-    ]
-    input_str = "".join(parts)
-    # 计算MD5
-    md5_hash = hashlib.md5(input_str.encode('utf-8')).hexdigest()
+    if a:
+        return header_xs_body(o, r, e, t)[0]
+    md5_hash = hashlib.md5((str(o) + str(r) + str(e)).encode('utf-8')).hexdigest()
 
     # 使用自定义Base64编码
     return custom_base64_encode(md5_hash) + "3"
@@ -151,3 +365,7 @@ if __name__ == "__main__":
     print("x-s结果:", result)
     result = header_xs_common()
     print("x-s-common结果:", result)
+    print("不一致的样本:", verify_custom_base64())
+    print("utf8编码不一致的样本:", verify_js_utf8_encode())
+    benchmark_custom_base64()
+    benchmark_xs_common()
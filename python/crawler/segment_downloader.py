@@ -0,0 +1,206 @@
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from crawler_common import QuietHandler, StubServer
+
+
+class SegmentDownloader:
+    """
+    分段并发下载
+    先探测文件总长度，按字节范围切段，多个连接并行Range请求，每段直接写到预分配文件的对应位置；
+    全部完成后校验每段长度，只重试失败的段
+    已完成的段记录在.part旁边的.segments文件里，失败时保留.part，下次下载同一文件只下载没完成的段
+    """
+
+    def __init__(self, connections=4, segment_size=4 * 1024 * 1024, retries=3, chunk_size=64 * 1024,
+                 session=None, timeout=30):
+        self.connections = connections
+        self.segment_size = segment_size
+        self.retries = retries
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        if session is None:
+            session = requests.session()
+            adapter = HTTPAdapter(pool_connections=connections, pool_maxsize=connections, max_retries=3)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+    def probe(self, url, headers):
+        """
+        探测文件长度，服务器返回200（不支持Range）时返回None；
+        其他错误状态码（限流、403、5xx等）抛出HTTPError，由调用方重试
+        """
+        with self.session.get(url, headers=dict(headers, Range='bytes=0-0'), stream=True,
+                              timeout=self.timeout) as response:
+            if response.status_code == 200:
+                return None
+            if response.status_code != 206:
+                response.raise_for_status()
+                raise requests.HTTPError(f'探测文件长度失败 状态码{response.status_code}', response=response)
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            return int(total) if total.isdigit() else None
+
+    def load_done(self, temp_path, total):
+        """
+        读取上次已完成的段，文件长度或分段大小变了就作废
+        """
+        state_path = temp_path + '.segments'
+        if not os.path.exists(temp_path) or not os.path.exists(state_path):
+            return set()
+        try:
+            with open(state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        if state.get('total') != total or state.get('segment_size') != self.segment_size or \
+                os.path.getsize(temp_path) != total:
+            return set()
+        return set(state.get('done', []))
+
+    def save_done(self, temp_path, total, done):
+        state_path = temp_path + '.segments'
+        with open(state_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'total': total, 'segment_size': self.segment_size, 'done': sorted(done)}, f)
+        os.replace(state_path + '.tmp', state_path)
+
+    @staticmethod
+    def discard(temp_path):
+        for path in (temp_path, temp_path + '.segments'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def fetch_range(self, url, headers, file_path, start, end):
+        """
+        下载[start, end]写入文件对应位置，返回是否完整
+        """
+        try:
+            with self.session.get(url, headers=dict(headers, Range=f'bytes={start}-{end}'), stream=True,
+                                  timeout=self.timeout) as response:
+                if response.status_code != 206:
+                    print(f'分段下载失败 {start}-{end} 状态码{response.status_code}')
+                    return False
+                written = 0
+                with open(file_path, 'r+b') as f:
+                    f.seek(start)
+                    for chunk in response.iter_content(self.chunk_size):
+                        f.write(chunk)
+                        written += len(chunk)
+            return written == end - start + 1
+        except Exception as e:
+            print(f'分段下载失败 {start}-{end}', e)
+            return False
+
+    def download(self, url, headers, base_dir, file_name):
+        """
+        下载成功返回文件路径；服务器不支持Range返回None，由调用方改用单连接下载；
+        有分段没下完返回''（已完成的段保留，下次继续）；探测时服务器返回错误状态码抛出HTTPError
+        """
+        file_path = os.path.join(base_dir, file_name)
+        temp_path = file_path + '.part'
+        total = self.probe(url, headers)
+        if not total:
+            # 改用单连接下载，预分配的.part不能用来续传
+            if os.path.exists(temp_path + '.segments'):
+                self.discard(temp_path)
+            return None
+        if not os.path.exists(base_dir):
+            os.makedirs(base_dir)
+        done = self.load_done(temp_path, total)
+        if done:
+            print(f'继续上次的分段下载，已完成{len(done)}段')
+        else:
+            # 预分配文件，各段写到自己的偏移位置
+            with open(temp_path, 'wb') as f:
+                f.truncate(total)
+            self.save_done(temp_path, total, done)
+        pending = [(start, min(start + self.segment_size, total) - 1)
+                   for start in range(0, total, self.segment_size) if start not in done]
+        lock = threading.Lock()
+
+        def fetch(segment):
+            ok = self.fetch_range(url, headers, temp_path, *segment)
+            if ok:
+                with lock:
+                    done.add(segment[0])
+                    self.save_done(temp_path, total, done)
+            return ok
+
+        with ThreadPoolExecutor(max_workers=self.connections) as executor:
+            for i in range(self.retries):
+                if not pending:
+                    break
+                results = list(executor.map(fetch, pending))
+                pending = [segment for segment, ok in zip(pending, results) if not ok]
+                if not pending:
+                    break
+                print(f'{len(pending)}个分段下载失败，开始重试')
+                time.sleep(1)
+        if pending:
+            # 保留.part和已完成的段，下次从这里继续
+            return ''
+        if os.path.getsize(temp_path) != total:
+            self.discard(temp_path)
+            return ''
+        os.replace(temp_path, file_path)
+        os.remove(temp_path + '.segments')
+        return file_path
+
+
+class RangeFileServer(StubServer):
+    """
+    支持Range请求的本地桩服务，fail_times指定前几次分段请求中途断开
+    """
+
+    def __init__(self, data, fail_times=0, host='127.0.0.1', port=0):
+        state = {'fail_times': fail_times}
+        lock = threading.Lock()
+
+        class Handler(QuietHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                start, end = 0, len(data) - 1
+                match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                if match:
+                    start = int(match.group(1))
+                    if match.group(2):
+                        end = min(int(match.group(2)), end)
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+                else:
+                    self.send_response(200)
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.end_headers()
+                body = data[start:end + 1]
+                with lock:
+                    broken = match is not None and end > start and state['fail_times'] > 0
+                    if broken:
+                        state['fail_times'] -= 1
+                if broken:
+                    self.wfile.write(body[:len(body) // 2])
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+        super().__init__(Handler, path='/video.m4s', host=host, port=port)
+
+
+if __name__ == '__main__':
+    data = os.urandom(20 * 1024 * 1024 + 123)
+    with RangeFileServer(data, fail_times=2) as server:
+        downloader = SegmentDownloader(connections=8, segment_size=1024 * 1024)
+        start = time.perf_counter()
+        path = downloader.download(server.url, {}, 'segment_test', 'video.m4s')
+        print(f'下载完成：{path}，耗时{time.perf_counter() - start:.3f}s')
+        with open(path, 'rb') as f:
+            print('内容一致：', f.read() == data)
+        os.remove(path)